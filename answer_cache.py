@@ -0,0 +1,78 @@
+# answer_cache.py
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Returns stored answers for questions whose embedding is close to a recent one"""
+
+    def __init__(self, embeddings, threshold=0.92, ttl=3600, max_items=1000):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        # One LRU per namespace, so RAG-only and web-search answers never mix
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "latency_saved_seconds": 0.0}
+
+    def hit_ratio(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def _embed(self, query: str):
+        # The exact text retrieval embeds, so the second embedding is an embedding-cache hit
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query: str, namespace: str):
+        vector = self._embed(query)
+        now = time.time()
+        with self.lock:
+            entries = self.namespaces.get(namespace)
+            if entries:
+                for key in [k for k, e in entries.items() if now - e["created"] > self.ttl]:
+                    del entries[key]
+            if not entries:
+                self.stats["misses"] += 1
+                return None
+
+            keys = list(entries)
+            matrix = np.stack([entries[k]["vector"] for k in keys])
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            entry = entries[keys[best]]
+            entries.move_to_end(keys[best])
+            self.stats["hits"] += 1
+            self.stats["latency_saved_seconds"] += entry["latency"]
+            return entry["answer"]
+
+    def store(self, query: str, namespace: str, answer: str, latency: float):
+        vector = self._embed(query)
+        with self.lock:
+            entries = self.namespaces.setdefault(namespace, OrderedDict())
+            entries[query] = {"vector": vector, "answer": answer, "latency": latency, "created": time.time()}
+            entries.move_to_end(query)
+            while len(entries) > self.max_items:
+                entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drops every stored answer, e.g. after the collection is re-ingested"""
+        with self.lock:
+            self.namespaces.clear()
+            self.stats["invalidations"] += 1
+
+    async def alookup(self, query: str, namespace: str):
+        return await asyncio.to_thread(self.lookup, query, namespace)
+
+    async def astore(self, query: str, namespace: str, answer: str, latency: float):
+        await asyncio.to_thread(self.store, query, namespace, answer, latency)
@@ -1,50 +1,45 @@
 # app.py
 import streamlit as st
 import requests
-import sqlite3
+import json
 import time
+import uuid
 from datetime import datetime, timedelta
+from conversation_store import get_store
 
 # Initialize Streamlit page configuration
 st.set_page_config(page_title="RAG + Web Search QA", layout="centered")
 
 st.title("📚🌐 Ca' Foscari AI-Based Assistant")
 
-# Setup database connection
+# One pooled conversation store shared by every rerun and session
+@st.cache_resource
 def init_db():
-    conn = sqlite3.connect('conversations.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT,
-            conversation TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Add a new conversation to the database
-def add_conversation(email, conversation):
-    conn = sqlite3.connect('conversations.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO conversations (email, conversation) VALUES (?, ?)', (email, conversation))
-    conn.commit()
-    conn.close()
+    return get_store('conversations.db')
 
 # Retrieve the last conversation for a specific email
 def get_last_conversation(email):
-    conn = sqlite3.connect('conversations.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM conversations WHERE email = ? ORDER BY timestamp DESC LIMIT 1', (email,))
-    result = c.fetchone()
-    conn.close()
-    return result
+    return init_db().last_session(email)
+
+# Stream the answer from the backend, yielding visible tokens as they arrive
+def stream_answer(payload, stats):
+    with requests.post("http://localhost:8000/ask/stream", json=payload, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "token":
+                yield event["text"]
+            elif event["type"] == "done":
+                stats.update(event)
+            elif event["type"] == "error":
+                yield f"The assistant is busy right now, please try again in {event['retry_after']:.0f} seconds."
 
 # Initialize session state for conversation history and timestamp
 if "conversation" not in st.session_state:
     st.session_state.conversation = []
+    st.session_state.session_id = uuid.uuid4().hex
     st.session_state.last_interaction_time = datetime.now()
 
 # Input UI: User email and checkbox for web search activation
@@ -56,6 +51,7 @@ if email:
     # Check if the last conversation has expired (15-minute timeout)
     if datetime.now() - st.session_state.last_interaction_time > timedelta(minutes=15):
         st.session_state.conversation = []
+        st.session_state.session_id = uuid.uuid4().hex
         st.session_state.last_interaction_time = datetime.now()
 
     # Input box for the user to ask a question
@@ -78,46 +74,41 @@ if email:
         # Update the last interaction time
         st.session_state.last_interaction_time = datetime.now()
 
-        with st.spinner("Getting answer..."):
-            try:
-                # Prepare the conversation history (only previous assistant messages)
-                response = requests.post(
-                    "http://localhost:8000/ask",
-                    json={
-                        "query": query,
-                        "use_web_search": use_web,
-                        "conversation_history": st.session_state.conversation
-                    }
-                )
-                
-                if response.status_code == 200:
-                    answer = response.json().get("answer", "No answer returned.")
-                    # Add assistant response to conversation
-                    st.session_state.conversation.append(answer)
-                    
-                    # Save the current conversation to the database
-                    add_conversation(email, " | ".join(st.session_state.conversation))
-                    
-                    # Display the new messages
-                    with st.chat_message("user"):
-                        st.write(query)
-                    with st.chat_message("assistant"):
-                        st.write(answer)
-                    
-                    # Rerun to update the display
-                    st.rerun()
-                else:
-                    st.error(f"API Error: {response.status_code}")
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
+        try:
+            stats = {}
+            with st.chat_message("user"):
+                st.write(query)
+            # Render visible answer tokens as they arrive
+            with st.chat_message("assistant"):
+                answer = st.write_stream(stream_answer({
+                    "query": query,
+                    "email": email,
+                    "session_id": st.session_state.session_id,
+                    "use_web_search": use_web
+                }, stats))
+
+            if not answer:
+                answer = "No answer returned."
+            # Add assistant response to conversation; the backend keeps and stores the session history
+            st.session_state.conversation.append(answer)
+
+            # Rerun to update the display
+            st.rerun()
+        except requests.HTTPError as e:
+            if e.response.status_code == 503:
+                st.warning(f"The assistant is busy right now, please try again in "
+                           f"{e.response.headers.get('Retry-After', 'a few')} seconds.")
+            else:
+                st.error(f"API Error: {e.response.status_code}")
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
 else:
     st.warning("Please enter your email to begin the conversation.")
 
 # Button to clear conversation
 if st.button("Clear Conversation"):
     st.session_state.conversation = []
+    st.session_state.session_id = uuid.uuid4().hex
     st.session_state.last_interaction_time = datetime.now()
     st.rerun()
 
-# Initialize database if not already done
-init_db()
@@ -0,0 +1,75 @@
+# benchmarks/bench_coalescing.py
+"""Upstream calls and latency for a burst of identical questions.
+
+Sends --clients concurrent /ask requests for the same question (with small
+spelling and case variations) to stubbed retrieval and LLM, with request
+coalescing on and off, and counts the retrievals and LLM calls made.
+
+    python benchmarks/bench_coalescing.py --clients 50 --llm-latency 1.0
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from bench_concurrency import StubEngine
+
+VARIANTS = [
+    "When does exam registration open?",
+    "when does exam registration open",
+    "When does  exam registration open ?",
+]
+
+
+class CountingEngine(StubEngine):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.retrievals = 0
+        self.llm_calls = 0
+        llm_ainvoke = self.llm.ainvoke
+
+        async def ainvoke(prompt):
+            self.llm_calls += 1
+            return await llm_ainvoke(prompt)
+        self.llm.ainvoke = ainvoke
+
+    async def aretrieve(self, query):
+        self.retrievals += 1
+        return await super().aretrieve(query)
+
+
+async def burst(args, coalesce):
+    engine = CountingEngine(args.retrieval_latency, args.llm_latency, False, args.workers)
+    engine.cfg["COALESCE_REQUESTS"] = coalesce
+    main.engine = engine
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(i):
+            response = await client.post("/ask", json={"query": VARIANTS[i % len(VARIANTS)]})
+            response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.clients)))
+        elapsed = time.perf_counter() - start
+    print(f"{'on' if coalesce else 'off':>10} {elapsed:>9.2f}s {engine.retrievals:>11} {engine.llm_calls:>10} "
+          f"{engine.coalescer.stats['coalesced']:>10}")
+
+
+async def main_async(args):
+    print(f"{'coalescing':>10} {'burst':>10} {'retrievals':>11} {'llm calls':>10} {'saved':>10}")
+    await burst(args, coalesce=False)
+    await burst(args, coalesce=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--retrieval-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=16)
+    asyncio.run(main_async(parser.parse_args()))
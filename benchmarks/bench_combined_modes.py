@@ -0,0 +1,107 @@
+# benchmarks/bench_combined_modes.py
+"""Compares web-search mode latency and LLM token usage: single grounded call vs three-call merge.
+
+Retrieval, crawling and the LLM are stubs. The LLM stub costs a fixed
+reasoning time per call plus a prefill time per prompt token, and counts
+the prompt and completion tokens it is asked for.
+
+    python benchmarks/bench_combined_modes.py --requests 20
+"""
+import os
+import sys
+import time
+import types
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from bench_concurrency import StubEngine
+from context_builder import count_tokens
+
+CHUNK = ("To enrol in a master's degree programme, candidates upload their documents in the "
+         "reserved area before the admission deadline and pay the first tuition instalment. ") * 12
+
+
+class CountingLLM:
+    def __init__(self, call_latency, prefill_per_token, completion_tokens):
+        self.call_latency = call_latency
+        self.prefill_per_token = prefill_per_token
+        self.completion = "word " * completion_tokens
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    async def ainvoke(self, prompt):
+        tokens = count_tokens(prompt)
+        self.calls += 1
+        self.prompt_tokens += tokens
+        self.completion_tokens += count_tokens(self.completion)
+        await asyncio.sleep(self.call_latency + tokens * self.prefill_per_token)
+        return types.SimpleNamespace(content=f"<think>reasoning</think>{self.completion}")
+
+
+def stub_documents(prefix, count):
+    return [types.SimpleNamespace(page_content=f"{prefix} {i}. {CHUNK}", metadata={"source": f"{prefix}-{i}"})
+            for i in range(count)]
+
+
+def install_stubs(args):
+    engine = StubEngine(args.retrieval_latency, 0, False, 16)
+    llm = CountingLLM(args.call_latency, args.prefill_per_token, args.completion_tokens)
+    engine.get_llm = lambda model_name=None: llm
+    engine.retriever.get_relevant_documents = lambda query: (time.sleep(args.retrieval_latency),
+                                                             stub_documents("Document", 5))[1]
+    main.engine = engine
+
+    async def get_web_documents(query, k=5):
+        await asyncio.sleep(args.web_latency)
+        return stub_documents("Web page", k)
+
+    async def get_info(query):
+        # The multi-call web branch: same retrieval, then its own LLM answer
+        docs = await get_web_documents(query)
+        response = await llm.ainvoke("\n\n".join(doc.page_content for doc in docs) + f"\n\nQuestion: {query}")
+        return response.content
+
+    main.get_web_documents = get_web_documents
+    main.get_info = get_info
+    return llm
+
+
+async def run_mode(mode, llm, total):
+    llm.calls = llm.prompt_tokens = llm.completion_tokens = 0
+    latencies = []
+    for i in range(total):
+        start = time.perf_counter()
+        await main.get_combined_answer(f"question {i}", "", mode)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "mode": mode,
+        "mean_s": round(statistics.mean(latencies), 3),
+        "p95_s": round(sorted(latencies)[int(0.95 * (total - 1))], 3),
+        "llm_calls": llm.calls / total,
+        "prompt_tokens": llm.prompt_tokens / total,
+        "completion_tokens": llm.completion_tokens / total,
+    }
+
+
+async def main_async(args):
+    llm = install_stubs(args)
+    print(f"{'mode':>7} {'mean s':>8} {'p95 s':>8} {'calls':>6} {'prompt tok':>11} {'compl tok':>10}")
+    for mode in ("multi", "single"):
+        r = await run_mode(mode, llm, args.requests)
+        print(f"{r['mode']:>7} {r['mean_s']:>8} {r['p95_s']:>8} {r['llm_calls']:>6.1f} "
+              f"{r['prompt_tokens']:>11.0f} {r['completion_tokens']:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--retrieval-latency", type=float, default=0.05)
+    parser.add_argument("--web-latency", type=float, default=1.0)
+    parser.add_argument("--call-latency", type=float, default=2.0, help="reasoning time per LLM call")
+    parser.add_argument("--prefill-per-token", type=float, default=0.0002)
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    asyncio.run(main_async(parser.parse_args()))
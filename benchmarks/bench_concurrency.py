@@ -0,0 +1,118 @@
+# benchmarks/bench_concurrency.py
+"""Measures /ask requests/sec on one worker as concurrent clients grow.
+
+Embedding/retrieval and the LLM are replaced by stubs with fixed latency, so
+the numbers reflect how well the event loop overlaps waiting requests.
+
+    python benchmarks/bench_concurrency.py --requests 64 --llm-latency 0.5
+    python benchmarks/bench_concurrency.py --blocking   # old synchronous behaviour
+"""
+import os
+import sys
+import time
+import types
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from answer_cache import SemanticAnswerCache
+from context_builder import ContextBuilder
+from session_store import SessionStore
+from singleflight import SingleFlight
+
+
+class StubRetriever:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_relevant_documents(self, query):
+        time.sleep(self.latency)
+        return [types.SimpleNamespace(page_content=f"Stub chunk about {query}", metadata={"source": "stub"})]
+
+
+class StubLLM:
+    def __init__(self, latency, blocking):
+        self.latency = latency
+        self.blocking = blocking
+
+    def invoke(self, prompt):
+        time.sleep(self.latency)
+        return types.SimpleNamespace(content="<think>stub</think>Stub answer.")
+
+    async def ainvoke(self, prompt):
+        if self.blocking:
+            return self.invoke(prompt)
+        await asyncio.sleep(self.latency)
+        return types.SimpleNamespace(content="<think>stub</think>Stub answer.")
+
+
+class StubEmbeddings:
+    def embed_query(self, text):
+        rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+        return rng.standard_normal(64).tolist()
+
+
+class StubEngine:
+    def __init__(self, retrieval_latency, llm_latency, blocking, workers):
+        self.cfg = {"chroma_collection": "stub"}
+        self.retriever = StubRetriever(retrieval_latency)
+        self.llm = StubLLM(llm_latency, blocking)
+        self.blocking = blocking
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Threshold above 1 disables the answer cache so every request does the full work
+        self.answer_cache = SemanticAnswerCache(StubEmbeddings(), threshold=1.01)
+        self.context_builder = ContextBuilder()
+        self.sessions = SessionStore()
+        self.coalescer = SingleFlight()
+
+    def reload_if_changed(self):
+        return False
+
+    async def aretrieve(self, query):
+        if self.blocking:
+            return self.retriever.get_relevant_documents(query)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.retriever.get_relevant_documents, query
+        )
+
+    def get_llm(self, model_name=None):
+        return self.llm
+
+
+async def run_level(client, concurrency, total):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            response = await client.post("/ask", json={"query": f"question {i}"})
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def main_async(args):
+    main.engine = StubEngine(args.retrieval_latency, args.llm_latency, args.blocking, args.workers)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"{'clients':>8} {'req/s':>10}")
+        for concurrency in args.levels:
+            rps = await run_level(client, concurrency, args.requests)
+            print(f"{concurrency:>8} {rps:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--retrieval-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--blocking", action="store_true", help="simulate the previous synchronous calls")
+    asyncio.run(main_async(parser.parse_args()))
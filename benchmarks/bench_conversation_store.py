@@ -0,0 +1,120 @@
+# benchmarks/bench_conversation_store.py
+"""Insert and lookup cost of the conversation store at millions of rows.
+
+Appends --rows messages spread over --users emails, in sessions of
+--session-length messages, through the batched store, then times the reads
+the backend makes: count_session (every request with several workers),
+count_session plus session_messages from an offset (picking up turns other
+workers stored), session_messages since the idle cutoff (restoring a
+session) and last_session (app.py). With --legacy it also times the
+previous layout: one whole-conversation row per turn, no index.
+
+    python benchmarks/bench_conversation_store.py --rows 2000000 --users 20000
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conversation_store import ConversationStore
+
+MESSAGE = "When is the deadline to register for the summer exam session of CT0371?"
+
+
+def bench_store(path, rows, users, lookups, batch_size, session_length):
+    store = ConversationStore(path, batch_size=batch_size, flush_interval=3600)
+    start = time.perf_counter()
+    now = time.time() - rows
+    for i in range(rows):
+        user = i % users
+        store.append(f"student{user}@stud.unive.it", "user" if i % 2 == 0 else "assistant",
+                     MESSAGE, session_id=f"s{user}-{i // users // session_length}", timestamp=now + i)
+    store.flush()
+    insert_seconds = time.perf_counter() - start
+
+    sessions_per_user = max(rows // users // session_length, 1)
+    reads = {
+        "count_session": lambda email, session_id: store.count_session(session_id),
+        "count_and_read_new": lambda email, session_id: store.session_messages(
+            session_id, offset=max(store.count_session(session_id) - 2, 0)),
+        "session_messages_since": lambda email, session_id: store.session_messages(session_id, since=now),
+        "last_session": lambda email, session_id: store.last_session(email),
+    }
+    latencies = {name: [] for name in reads}
+    for _ in range(lookups):
+        user = random.randrange(users)
+        email = f"student{user}@stud.unive.it"
+        session_id = f"s{user}-{random.randrange(sessions_per_user)}"
+        for name, read in reads.items():
+            start = time.perf_counter()
+            read(email, session_id)
+            latencies[name].append((time.perf_counter() - start) * 1000)
+    store.close()
+    return insert_seconds, latencies
+
+
+def bench_legacy(path, rows, users, lookups):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE conversations (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT, '
+                 'conversation TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    conversations = {}
+    start = time.perf_counter()
+    # One connection per insert and the whole joined conversation each turn, as app.py did
+    for i in range(rows):
+        email = f"student{i % users}@stud.unive.it"
+        conversations.setdefault(email, []).append(MESSAGE)
+        c = sqlite3.connect(path)
+        c.execute('INSERT INTO conversations (email, conversation) VALUES (?, ?)',
+                  (email, " | ".join(conversations[email])))
+        c.commit()
+        c.close()
+    insert_seconds = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(lookups):
+        email = f"student{random.randrange(users)}@stud.unive.it"
+        start = time.perf_counter()
+        conn.execute('SELECT * FROM conversations WHERE email = ? ORDER BY timestamp DESC LIMIT 1',
+                     (email,)).fetchone()
+        latencies.append((time.perf_counter() - start) * 1000)
+    conn.close()
+    return insert_seconds, {"latest_conversation": latencies}
+
+
+def report(name, rows, insert_seconds, latencies, path):
+    size_mb = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix)) / (1 << 20)
+    print(f"{name:>8}: {rows / insert_seconds:>10.0f} inserts/s  db={size_mb:.1f}MB")
+    for read, samples in latencies.items():
+        print(f"{'':>10}{read:<24} p50={statistics.median(samples):.3f}ms "
+              f"p99={sorted(samples)[int(0.99 * (len(samples) - 1))]:.3f}ms")
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="bench_store_")
+    path = os.path.join(workdir, "store.db")
+    insert_seconds, latencies = bench_store(path, args.rows, args.users, args.lookups, args.batch_size,
+                                            args.session_length)
+    report("store", args.rows, insert_seconds, latencies, path)
+
+    if args.legacy:
+        legacy_path = os.path.join(workdir, "legacy.db")
+        insert_seconds, latencies = bench_legacy(legacy_path, args.legacy_rows, args.users, args.lookups)
+        report("legacy", args.legacy_rows, insert_seconds, latencies, legacy_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--session-length", type=int, default=20, help="messages per session")
+    parser.add_argument("--legacy", action="store_true", help="also time the previous schema")
+    parser.add_argument("--legacy-rows", type=int, default=50_000,
+                        help="rows for the legacy run, which grows quadratically")
+    main(parser.parse_args())
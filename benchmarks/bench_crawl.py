@@ -0,0 +1,93 @@
+# benchmarks/bench_crawl.py
+"""Compares sequential and bounded-concurrency crawling against slow local pages.
+
+A stub HTTP server serves pages that each take --delay seconds to respond,
+and websearch.crawl_urls is run with a concurrency of 1 and then --concurrency.
+
+    python benchmarks/bench_crawl.py --pages 6 --delay 2 --concurrency 3
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the benchmark away from the real crawl cache
+os.environ.setdefault("CRAWL_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "crawl_cache.db"))
+import websearch
+
+PARAGRAPH = ("Students must register for exams through the reserved area before the deadline. "
+             "Tuition fees are paid in instalments according to the income bracket declared. ") * 5
+
+
+class SlowPageHandler(BaseHTTPRequestHandler):
+    delay = 1.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = f"<html><body><article><h1>{self.path}</h1>" + \
+               "".join(f"<p>{PARAGRAPH}</p>" for _ in range(10)) + "</article></body></html>"
+        payload = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(delay):
+    SlowPageHandler.delay = delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowPageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def timed_crawl(urls, concurrency, timeout):
+    await websearch.crawl_cache.db.execute("DELETE FROM pages")
+    await websearch.crawl_cache.db.commit()
+    start = time.perf_counter()
+    pages = await websearch.crawl_urls(urls, max_concurrency=concurrency, timeout=timeout, min_chars=0)
+    return time.perf_counter() - start, pages
+
+
+async def timed_crawl_cached(urls, concurrency, timeout):
+    start = time.perf_counter()
+    pages = await websearch.crawl_urls(urls, max_concurrency=concurrency, timeout=timeout, min_chars=0)
+    return time.perf_counter() - start, pages
+
+
+async def main_async(args):
+    server = start_server(args.delay)
+    host, port = server.server_address
+    urls = [f"http://{host}:{port}/page/{i}" for i in range(args.pages)]
+    await websearch.init_crawler()
+    try:
+        sequential, pages = await timed_crawl(urls, 1, args.timeout)
+        print(f"sequential:        {sequential:.2f}s ({len(pages)} pages)")
+        parallel, pages = await timed_crawl(urls, args.concurrency, args.timeout)
+        print(f"concurrency={args.concurrency:<5} {parallel:.2f}s ({len(pages)} pages)")
+        print(f"speedup:           {sequential / parallel:.2f}x")
+        cached, pages = await timed_crawl_cached(urls, args.concurrency, args.timeout)
+        print(f"warm cache:        {cached:.2f}s ({len(pages)} pages)")
+        order = [page.splitlines()[0] for page in pages]
+        assert order == [f"# Source: {url}" for url in urls], "ranking order not preserved"
+    finally:
+        await websearch.crawler.__aexit__(None, None, None)
+        await websearch.crawl_cache.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=6)
+    parser.add_argument("--delay", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    asyncio.run(main_async(parser.parse_args()))
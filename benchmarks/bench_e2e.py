@@ -0,0 +1,191 @@
+# benchmarks/bench_e2e.py
+"""End-to-end /ask benchmark on the offline provider back-ends.
+
+Serves benchmarks/site from a local HTTP server for the crawler, answers
+searches from benchmarks/fixtures/search_results.json, embeds with the
+hashing model and generates with the fake LLM, then drives /ask in RAG,
+single-call web and multi-call web modes at each concurrency level.
+Results (p50/p95/p99 latency, throughput) are printed and written as JSON.
+
+    python benchmarks/bench_e2e.py --levels 1 4 16 --requests 8 --output bench_e2e.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+QUESTIONS = [
+    "How do I register for an exam?",
+    "When are tuition fees due?",
+    "How does Erasmus credit recognition work?",
+    "What documents do international applicants need?",
+    "How can I withdraw from an exam?",
+    "Who awards regional scholarships?",
+]
+
+MODES = {
+    "rag": {"use_web_search": False},
+    "web-single": {"use_web_search": True, "combined_mode": "single"},
+    "web-multi": {"use_web_search": True, "combined_mode": "multi"},
+}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_site():
+    handler = partial(QuietHandler, directory=os.path.join(BENCH_DIR, "site"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_environment(workdir, site_url, args):
+    os.environ.update({
+        "EMBEDDINGS_PROVIDER": "hashing",
+        "LLM_PROVIDER": "fake",
+        "SEARCH_PROVIDER": "fixture",
+        "SEARCH_FIXTURE": os.path.join(BENCH_DIR, "fixtures", "search_results.json"),
+        "FIXTURE_SITE_URL": site_url,
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.tokens_per_second),
+        "CRAWL_CACHE_PATH": os.path.join(workdir, "crawl_cache.db"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.db"),
+    })
+    # websearch opens ./chroma_db relative to the working directory
+    os.chdir(workdir)
+
+
+def build_corpus(cfg):
+    """Ingests the static site pages as the PDF collection"""
+    import re
+    from langchain.schema import Document
+    from vectordatabase import open_collection, split_documents, write_batches
+    from lexical_index import build_from_collection
+
+    docs = []
+    for name in sorted(os.listdir(os.path.join(BENCH_DIR, "site"))):
+        with open(os.path.join(BENCH_DIR, "site", name), "r") as f:
+            text = re.sub(r"<[^>]+>", " ", f.read())
+        docs.append(Document(page_content=" ".join(text.split()), metadata={"source": name, "page": 0}))
+
+    persist_directory = os.path.join(cfg['chroma_base_dir'], cfg['chroma_collection'])
+    db_instance = open_collection(persist_directory, cfg['chroma_collection'])
+    chunks = split_documents(docs, 500, 100)
+    write_batches(db_instance, chunks, cfg['BATCH_SIZE'])
+    build_from_collection(db_instance, os.path.join(persist_directory, "lexical_index"))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+async def run_level(client, payload, concurrency, total):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/ask", json={**payload, "query": QUESTIONS[i % len(QUESTIONS)]})
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 3),
+        "p50_s": round(percentile(latencies, 0.50), 4) if latencies else None,
+        "p95_s": round(percentile(latencies, 0.95), 4) if latencies else None,
+        "p99_s": round(percentile(latencies, 0.99), 4) if latencies else None,
+    }
+
+
+async def main_async(args):
+    server = start_site()
+    site_url = f"http://127.0.0.1:{server.server_address[1]}"
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    output = os.path.abspath(args.output)
+    configure_environment(workdir, site_url, args)
+
+    import httpx
+    import main
+    import websearch
+    from engine import RAGEngine
+
+    with open(os.path.join(ROOT, "config.json"), "r") as f:
+        cfg = json.load(f)
+    cfg.update(chroma_base_dir=workdir, chroma_collection="bench",
+               ANSWER_CACHE_THRESHOLD=1.01,  # measure the full path, not cache hits
+               COALESCE_REQUESTS=False)  # nor concurrent duplicates sharing one computation
+    # The fake LLM and search have no quota: don't let the real provider limits throttle or shed
+    cfg["RATE_LIMITS"] = {provider: {"requests_per_minute": 1e9, "tokens_per_minute": 1e12}
+                          for provider in ("llm", "embeddings", "search")}
+    cfg["RATE_LIMIT_DB"] = None  # nor a deployment's shared buckets
+    build_corpus(cfg)
+
+    main.engine = RAGEngine(cfg)
+    main.engine.install_executor()
+    await websearch.init_crawler()
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for mode in args.modes:
+            for concurrency in args.levels:
+                result = await run_level(client, MODES[mode], concurrency, concurrency * args.requests)
+                result["mode"] = mode
+                results.append(result)
+                print(f"{mode:>10} c={concurrency:<3} {result['throughput_rps']:>8} req/s  "
+                      f"p50={result['p50_s']}s p95={result['p95_s']}s p99={result['p99_s']}s "
+                      f"errors={result['errors']}")
+
+    await websearch.crawler.__aexit__(None, None, None)
+    server.shutdown()
+
+    try:
+        commit = subprocess.run(["git", "-C", ROOT, "rev-parse", "HEAD"],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    with open(output, "w") as f:
+        json.dump({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": commit,
+            "settings": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=8, help="requests per concurrent client")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--output", default="bench_e2e.json")
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,127 @@
+# benchmarks/bench_ingest_memory.py
+"""Reports peak RSS of PDF ingestion over a large synthetic PDF set.
+
+Compares the page-streaming pipeline with the previous approach that joined
+every PDF into one string and kept all of them before splitting. The vector
+store is a stub that discards chunks, so only parsing/splitting memory shows.
+
+    python benchmarks/bench_ingest_memory.py --files 200 --pages 50
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+LINE = "Article {n}. Students enrolled in a degree programme must pass the exams listed in the study plan."
+
+
+def write_pdf(path, pages, lines_per_page=45):
+    """Writes a minimal text PDF without any third-party library"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        text = " T* ".join(f"({LINE.format(n=p * lines_per_page + i)}) Tj" for i in range(lines_per_page))
+        stream = f"BT /F1 9 Tf 12 TL 40 780 Td {text} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode())
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+class StubStore:
+    def __init__(self):
+        self.chunks = 0
+
+    def add_documents(self, documents, ids=None):
+        self.chunks += len(documents)
+
+    def persist(self):
+        pass
+
+    def get(self, **kwargs):
+        return {"ids": [], "documents": []}
+
+
+def run_child(mode, input_dir, settings):
+    import pdf_processor
+    store = StubStore()
+    start = time.perf_counter()
+
+    if mode == "streaming":
+        pdf_processor.open_collection = lambda db_path, collection: store
+        pdf_processor.build_from_collection = lambda db_instance, index_dir: None
+        pdf_processor.handle_pdf_processing(input_dir, tempfile.mkdtemp(), "bench", settings)
+    else:
+        from langchain.schema import Document
+        from langchain_community.document_loaders import PyPDFLoader
+        from vectordatabase import split_documents
+        docs = []
+        for filename in os.listdir(input_dir):
+            path = os.path.join(input_dir, filename)
+            pages = PyPDFLoader(path).load_and_split()
+            docs.append(Document(page_content="\n\n".join(p.page_content.strip() for p in pages),
+                                 metadata={"source": path}))
+        chunks = split_documents(docs, settings['CHUNK_SIZE'], settings['CHUNK_OVERLAP'])
+        for i in range(0, len(chunks), settings['BATCH_SIZE']):
+            store.add_documents(chunks[i:i + settings['BATCH_SIZE']])
+
+    print(json.dumps({
+        "mode": mode,
+        "chunks": store.chunks,
+        "seconds": round(time.perf_counter() - start, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def main(args):
+    settings = {"CHUNK_SIZE": 2000, "CHUNK_OVERLAP": 300, "BATCH_SIZE": 100,
+                "INGEST_BATCH_MAX_BYTES": args.batch_bytes}
+    if args.child:
+        run_child(args.child, args.input_dir, settings)
+        return
+
+    input_dir = args.input_dir or tempfile.mkdtemp(prefix="bench_pdfs_")
+    if not os.listdir(input_dir):
+        for i in range(args.files):
+            write_pdf(os.path.join(input_dir, f"doc_{i:04d}.pdf"), args.pages)
+    print(f"Synthetic set: {args.files} PDFs x {args.pages} pages in {input_dir}")
+
+    # Each mode runs in its own process so peak RSS is not shared
+    for mode in ("concatenate", "streaming"):
+        result = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--input-dir", input_dir, "--batch-bytes", str(args.batch_bytes)],
+            capture_output=True, text=True, check=True
+        )
+        print(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--batch-bytes", type=int, default=4 << 20, help="INGEST_BATCH_MAX_BYTES")
+    parser.add_argument("--input-dir")
+    parser.add_argument("--child", choices=["concatenate", "streaming"], help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+# benchmarks/bench_ratelimit.py
+"""Burst behaviour against a provider that enforces its own per-minute quota.
+
+A stub provider answers 429 once its quota, replenished continuously at
+--quota calls per minute as Groq and OpenAI do, is used up. A burst of --burst interactive calls, while a background job
+keeps calling, is sent straight to it and then through ratelimit, reporting
+successes, provider 429s, shed calls (503 + Retry-After) and latency.
+
+    python benchmarks/bench_ratelimit.py --quota 60 --burst 120
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ratelimit
+
+
+class QuotaError(Exception):
+    status_code = 429
+
+
+class StubProvider:
+    def __init__(self, quota, latency):
+        self.quota = ratelimit.TokenBucket(quota)
+        self.latency = latency
+        self.rejected = 0
+
+    async def complete(self, prompt):
+        self.quota.refill(time.monotonic())
+        if self.quota.level < 1:
+            self.rejected += 1
+            raise QuotaError("429 rate limit exceeded")
+        self.quota.level -= 1
+        await asyncio.sleep(self.latency)
+        return "ok"
+
+
+async def run(args, limited):
+    provider = StubProvider(args.quota, args.latency)
+    ratelimit.configure({
+        "RATE_LIMITS": {"bench": {"requests_per_minute": args.quota}},
+        "QUEUE_MAX_WAIT_SECONDS": args.max_wait,
+        "RETRY_ATTEMPTS": 2,
+        "RETRY_BASE_SECONDS": 0.1,
+    })
+    outcomes = {"ok": 0, "429": 0, "shed": 0}
+    latencies = []
+    background_calls = 0
+
+    async def interactive(i):
+        start = time.monotonic()
+        try:
+            if limited:
+                await ratelimit.acall("bench", provider.complete, f"question {i}")
+            else:
+                await provider.complete(f"question {i}")
+            outcomes["ok"] += 1
+            latencies.append(time.monotonic() - start)
+        except ratelimit.Overloaded:
+            outcomes["shed"] += 1
+        except QuotaError:
+            outcomes["429"] += 1
+
+    async def background(stop):
+        nonlocal background_calls
+        ratelimit.current_priority.set(ratelimit.BACKGROUND)
+        while not stop.is_set():
+            try:
+                if limited:
+                    await ratelimit.acall("bench", provider.complete, "ingest")
+                else:
+                    await provider.complete("ingest")
+                background_calls += 1
+            except QuotaError:
+                await asyncio.sleep(0.1)
+
+    stop = asyncio.Event()
+    job = asyncio.create_task(background(stop))
+    await asyncio.sleep(args.warmup)
+    await asyncio.gather(*(interactive(i) for i in range(args.burst)))
+    stop.set()
+    job.cancel()
+
+    p50 = statistics.median(latencies) if latencies else 0.0
+    print(f"{'limited' if limited else 'direct':>8} {outcomes['ok']:>6} {outcomes['429']:>6} {outcomes['shed']:>6} "
+          f"{p50:>8.2f}s {background_calls:>11} {provider.rejected:>13}")
+
+
+async def main_async(args):
+    print(f"{'mode':>8} {'ok':>6} {'429':>6} {'shed':>6} {'p50':>9} {'background':>11} {'provider 429s':>13}")
+    await run(args, limited=False)
+    await run(args, limited=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quota", type=int, default=60, help="provider requests per minute")
+    parser.add_argument("--burst", type=int, default=120, help="concurrent interactive calls")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--max-wait", type=float, default=10.0, help="QUEUE_MAX_WAIT_SECONDS")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of background load before the burst")
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,148 @@
+# benchmarks/bench_startup.py
+"""Import time of the API and resident memory per worker.
+
+First times `import main` in fresh interpreters (no browser, no Chroma
+opened), then optionally starts `uvicorn main:app --workers N` in local and
+service crawler mode and reports, once /metrics answers, the startup time and
+the RSS of each worker including its child processes (the headless browser
+in local mode) and of the shared crawler service. Linux only (/proc).
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --workers 4 --importtime
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import statistics
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import json, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+with open("/proc/self/statm") as f:
+    rss_mb = int(f.read().split()[1]) * 4096 / (1 << 20)
+print(json.dumps({"seconds": elapsed, "rss_mb": rss_mb}))
+"""
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except OSError:
+        return 0.0
+
+
+def children(pid):
+    """Direct child pids, from /proc/<pid>/task/*/children"""
+    found = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                found.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return found
+
+
+def tree_rss_mb(pid):
+    return rss_mb(pid) + sum(tree_rss_mb(child) for child in children(pid))
+
+
+def measure_imports(runs, env):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    print(f"import main: {statistics.median(s['seconds'] for s in samples):.2f}s median over {runs} runs, "
+          f"RSS after import {statistics.median(s['rss_mb'] for s in samples):.0f}MB")
+
+
+def print_importtime(env, top=15):
+    """Slowest modules by cumulative import time, from python -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=env,
+                            capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        # "import time:  self [us] | cumulative | module"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), module.rstrip()))
+    for cumulative_us, module in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1e6:>7.3f}s  {module}")
+
+
+def wait_ready(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def measure_workers(args, mode, env):
+    env = {**env, "CRAWLER_MODE": mode, "WEB_CONCURRENCY": str(args.workers)}
+    service = None
+    if mode == "service":
+        service = subprocess.Popen([sys.executable, "crawler_service.py"], cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(args.service_wait)
+
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+                               "--workers", str(args.workers)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(args.port, args.timeout):
+            print(f"{mode:>8}: not ready after {args.timeout}s")
+            return
+        # Give every worker time to finish its startup hook
+        time.sleep(args.settle)
+        ready = time.monotonic() - start
+        workers = children(server.pid)
+        per_worker = [tree_rss_mb(pid) for pid in workers]
+        service_rss = tree_rss_mb(service.pid) if service else 0.0
+        total = tree_rss_mb(server.pid) + service_rss
+        print(f"{mode:>8}: ready in {ready:.1f}s, {len(workers)} workers, per worker "
+              f"{statistics.mean(per_worker) if per_worker else 0:.0f}MB, crawler service {service_rss:.0f}MB, "
+              f"total {total:.0f}MB")
+    finally:
+        server.terminate()
+        server.wait()
+        if service:
+            service.terminate()
+            service.wait()
+
+
+def main(args):
+    env = dict(os.environ)
+    measure_imports(args.runs, env)
+    if args.importtime:
+        print_importtime(env)
+    if args.workers:
+        for mode in ("local", "service"):
+            measure_workers(args, mode, env)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="list the slowest imports")
+    parser.add_argument("--workers", type=int, default=0, help="also start uvicorn with this many workers")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--settle", type=float, default=5.0)
+    parser.add_argument("--service-wait", type=float, default=5.0)
+    main(parser.parse_args())
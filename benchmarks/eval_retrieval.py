@@ -0,0 +1,75 @@
+# benchmarks/eval_retrieval.py
+"""Offline retrieval evaluation: recall@k and latency per retrieval mode.
+
+The question set is JSONL, one object per line:
+
+    {"question": "How do I register for CT0371?", "relevant": ["regolamento_esami.pdf"]}
+
+"relevant" lists substrings of the expected chunk sources. A question counts
+as recalled when any of the top k chunks comes from one of them.
+
+    python benchmarks/eval_retrieval.py questions.jsonl --k 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+import config
+from engine import RAGEngine
+
+MODES = {
+    "vector": {"HYBRID_RETRIEVAL": False},
+    "hybrid": {"HYBRID_RETRIEVAL": True, "RERANKER": None},
+    "lexical": {"HYBRID_RETRIEVAL": True, "VECTOR_WEIGHT": 0.0, "LEXICAL_WEIGHT": 1.0, "RERANKER": None},
+    "hybrid+rerank": {"HYBRID_RETRIEVAL": True, "RERANKER": "flashrank"},
+}
+
+
+def evaluate(engine, questions):
+    hits = 0
+    latencies = []
+    for item in questions:
+        start = time.perf_counter()
+        docs = engine.retriever.get_relevant_documents(item["question"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        sources = [doc.metadata.get("source", "") for doc in docs]
+        if any(relevant in source for relevant in item["relevant"] for source in sources):
+            hits += 1
+    latencies.sort()
+    return {
+        "recall": round(hits / len(questions), 3),
+        "p50_ms": round(statistics.median(latencies), 1),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))], 1),
+    }
+
+
+def main(args):
+    load_dotenv()
+    with open(args.questions, "r") as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+
+    base = config.read_config()
+    base["RETRIEVER_K"] = args.k
+    results = {}
+    for mode in args.modes:
+        engine = RAGEngine({**base, **MODES[mode]})
+        results[mode] = evaluate(engine, questions)
+        print(f"{mode:>14}  recall@{args.k}={results[mode]['recall']:.3f}  "
+              f"p50={results[mode]['p50_ms']}ms  p95={results[mode]['p95_ms']}ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"k": args.k, "questions": len(questions), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--output", help="write results as JSON")
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+# context_builder.py
+import re
+import logging
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when installed, otherwise a 4-chars-per-token estimate"""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def shingles(text: str, size: int = 5) -> set:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def merge_overlap(first: str, second: str, min_overlap: int = 40):
+    """Joins two chunks when the end of first repeats the start of second, else None"""
+    if second in first:
+        return first
+    for size in range(min(len(first), len(second)) - 1, min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return None
+
+
+class ContextBuilder:
+    """Assembles retrieved chunks into a prompt context within a token budget.
+
+    Chunks are taken in relevance order; overlapping neighbours from the same
+    source are merged, near-duplicates (including of reference_texts) dropped.
+    """
+
+    def __init__(self, budget_tokens=3000, dedup_threshold=0.8, min_overlap=40):
+        self.budget_tokens = budget_tokens
+        self.dedup_threshold = dedup_threshold
+        self.min_overlap = min_overlap
+
+    def _is_duplicate(self, candidate: set, seen: list) -> bool:
+        if not candidate:
+            return True
+        return any(len(candidate & other) / len(candidate) >= self.dedup_threshold for other in seen)
+
+    def build(self, docs, reference_texts=(), budget_tokens=None):
+        """Returns (context, stats) for docs ordered by relevance"""
+        if budget_tokens is None:
+            budget_tokens = self.budget_tokens
+        pieces = []  # [source, text], in order of best rank
+        merged = 0
+        for doc in docs:
+            source = (doc.metadata.get("source"), doc.metadata.get("page"))
+            text = doc.page_content.strip()
+            for piece in pieces:
+                if piece[0] != source:
+                    continue
+                joined = merge_overlap(piece[1], text, self.min_overlap) or \
+                    merge_overlap(text, piece[1], self.min_overlap)
+                if joined is not None:
+                    piece[1] = joined
+                    merged += 1
+                    break
+            else:
+                pieces.append([source, text])
+
+        seen = [shingles(text) for text in reference_texts]
+        selected = []
+        duplicates = 0
+        used_tokens = 0
+        for _, text in pieces:
+            fingerprint = shingles(text)
+            if self._is_duplicate(fingerprint, seen):
+                duplicates += 1
+                continue
+            tokens = count_tokens(text)
+            if used_tokens + tokens > budget_tokens:
+                if selected:
+                    continue
+                # Never return an empty context: cut the most relevant piece to fit
+                text = text[:budget_tokens * 4]
+                tokens = count_tokens(text)
+            seen.append(fingerprint)
+            selected.append(text)
+            used_tokens += tokens
+
+        stats = {
+            "chunks": len(docs),
+            "merged": merged,
+            "duplicates": duplicates,
+            "selected": len(selected),
+            "context_tokens": used_tokens,
+        }
+        logging.debug(f"Context assembled: {stats}")
+        return "\n\n".join(selected), stats
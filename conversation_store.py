@@ -0,0 +1,121 @@
+# conversation_store.py
+import time
+import sqlite3
+import threading
+
+
+class ConversationStore:
+    """Append-only per-message conversation log on one pooled WAL connection.
+
+    Writes are buffered and flushed in batches, either when batch_size
+    messages are pending or every flush_interval seconds.
+    """
+
+    def __init__(self, path="conversations.db", batch_size=50, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = []
+        self.closed = threading.Event()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL,
+                session_id TEXT,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_email_ts ON messages (email, timestamp)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, timestamp)')
+        self.conn.commit()
+
+        self.flusher = threading.Thread(target=self._flush_loop, name="conversation-flush", daemon=True)
+        self.flusher.start()
+
+    def append(self, email, role, content, session_id=None, timestamp=None):
+        self.append_many([(email, session_id, role, content, timestamp or time.time())])
+
+    def append_many(self, rows):
+        """rows are (email, session_id, role, content, timestamp) tuples"""
+        with self.lock:
+            self.pending.extend(rows)
+            if len(self.pending) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self.pending:
+            return
+        self.conn.executemany(
+            'INSERT INTO messages (email, session_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)',
+            self.pending
+        )
+        self.conn.commit()
+        self.pending = []
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as error:
+                print(f"Conversation flush error: {error}")
+
+    def session_messages(self, session_id, since=None, offset=0):
+        """Returns the messages of one session, oldest first, as (role, content, timestamp)"""
+        with self.lock:
+            self._flush_locked()
+            rows = self.conn.execute(
+                'SELECT role, content, timestamp FROM messages WHERE session_id = ? AND timestamp >= ? '
+                'ORDER BY timestamp, id LIMIT -1 OFFSET ?',
+                (session_id, since or 0, offset)
+            ).fetchall()
+        return rows
+
+    def count_session(self, session_id):
+        with self.lock:
+            self._flush_locked()
+            return self.conn.execute('SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+
+    def last_session(self, email):
+        """Returns every message of the most recent session of email, oldest first"""
+        with self.lock:
+            self._flush_locked()
+            latest = self.conn.execute(
+                'SELECT session_id FROM messages WHERE email = ? ORDER BY timestamp DESC, id DESC LIMIT 1', (email,)
+            ).fetchone()
+            if latest is None:
+                return []
+            rows = self.conn.execute(
+                'SELECT role, content, timestamp FROM messages WHERE email = ? AND session_id IS ? '
+                'ORDER BY timestamp, id',
+                (email, latest[0])
+            ).fetchall()
+        return rows
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+        self.conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path="conversations.db") -> ConversationStore:
+    """Returns the process-wide store for path, so every caller shares one connection"""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ConversationStore(path)
+        return store
@@ -0,0 +1,126 @@
+# crawl_cache.py
+import time
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import aiohttp
+import aiosqlite
+
+TRACKING_PARAMS = ("utm_", "gclid", "fbclid")
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form used as the cache key"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+class CrawlCache:
+    """On-disk cache of pruned page markdown with TTL, size bound and revalidation"""
+
+    def __init__(self, path="./crawl_cache.db", ttl=86400, max_entries=2000, revalidate_timeout=5):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.revalidate_timeout = revalidate_timeout
+        self.db = None
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stale": 0, "evicted": 0}
+
+    async def open(self):
+        if self.db is not None:
+            return
+        self.db = await aiosqlite.connect(self.path)
+        await self.db.execute("PRAGMA journal_mode=WAL")
+        await self.db.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        await self.db.execute('CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages (accessed_at)')
+        await self.db.commit()
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+    async def get(self, url: str):
+        """Returns cached markdown for url, revalidating stale entries, or None on a miss"""
+        key = normalize_url(url)
+        async with self.db.execute(
+            'SELECT content, etag, last_modified, fetched_at FROM pages WHERE url = ?', (key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+
+        content, etag, last_modified, fetched_at = row
+        now = time.time()
+        if now - fetched_at > self.ttl:
+            if not await self._revalidate(url, etag, last_modified):
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.stats["revalidated"] += 1
+            await self.db.execute('UPDATE pages SET fetched_at = ? WHERE url = ?', (now, key))
+
+        await self.db.execute('UPDATE pages SET accessed_at = ? WHERE url = ?', (now, key))
+        await self.db.commit()
+        self.stats["hits"] += 1
+        return content
+
+    async def put(self, url: str, content: str, headers: dict = None):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        now = time.time()
+        await self.db.execute(
+            'INSERT OR REPLACE INTO pages (url, content, etag, last_modified, fetched_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (normalize_url(url), content, headers.get("etag"), headers.get("last-modified"), now, now)
+        )
+        await self._evict()
+        await self.db.commit()
+
+    async def _evict(self):
+        async with self.db.execute('SELECT COUNT(*) FROM pages') as cursor:
+            (count,) = await cursor.fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            await self.db.execute(
+                'DELETE FROM pages WHERE url IN (SELECT url FROM pages ORDER BY accessed_at LIMIT ?)',
+                (excess,)
+            )
+            self.stats["evicted"] += excess
+
+    async def _revalidate(self, url: str, etag: str, last_modified: str) -> bool:
+        """Asks the origin whether the cached copy is still current (HTTP 304)"""
+        if not etag and not last_modified:
+            return False
+        request_headers = {}
+        if etag:
+            request_headers["If-None-Match"] = etag
+        if last_modified:
+            request_headers["If-Modified-Since"] = last_modified
+        try:
+            timeout = aiohttp.ClientTimeout(total=self.revalidate_timeout)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.head(url, headers=request_headers, allow_redirects=True) as response:
+                    return response.status == 304
+        except Exception as e:
+            logging.debug(f"Revalidation failed for {url}: {e}")
+            return False
@@ -0,0 +1,159 @@
+# crawler_service.py
+"""One crawler process shared by every API worker.
+
+It owns the headless browser, the crawl cache and the web-chunk index in
+./chroma_db, so that index has a single writer. Workers started with
+CRAWLER_MODE=service send one NDJSON request per line over a local socket:
+
+    {"id": 1, "query": "...", "urls": ["..."], "k": 5}
+
+and get back {"id": 1, "documents": [[text, metadata], ...]} or {"id": 1, "error": "..."};
+"documents" is null when no page could be crawled.
+{"id": 1, "cancel": true} stops a request whose caller has gone away.
+Requests run concurrently up to CRAWLER_SERVICE_CONCURRENCY; the rest wait in queue.
+
+    python crawler_service.py
+    CRAWLER_MODE=service WEB_CONCURRENCY=4 uvicorn main:app --workers 4
+"""
+import os
+import json
+import asyncio
+import logging
+import itertools
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class CrawlerClient:
+    """Worker side: one connection, many concurrent requests matched by id"""
+
+    def __init__(self, address="127.0.0.1:8765"):
+        self.address = address
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.ids = itertools.count(1)
+        self.connect_lock = asyncio.Lock()
+        self.reader_task = None
+
+    async def connect(self):
+        async with self.connect_lock:
+            if self.writer is not None and not self.writer.is_closing():
+                return
+            host, port = parse_address(self.address)
+            self.reader, self.writer = await asyncio.open_connection(host, port, limit=64 * 1024 * 1024)
+            self.reader_task = asyncio.create_task(self._read_responses())
+            logging.info(f"Connected to crawler service at {self.address}")
+
+    async def _read_responses(self):
+        try:
+            while line := await self.reader.readline():
+                response = json.loads(line)
+                future = self.pending.pop(response["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            # Connection lost: fail the waiting requests, the next call reconnects
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("crawler service connection closed"))
+            self.pending.clear()
+            self.writer.close()
+
+    def _send(self, message):
+        self.writer.write((json.dumps(message) + "\n").encode())
+
+    async def documents(self, query, urls, k=5):
+        from langchain_core.documents import Document
+        await self.connect()
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            self._send({"id": request_id, "query": query, "urls": urls, "k": k})
+            await self.writer.drain()
+            response = await future
+        except asyncio.CancelledError:
+            # Stop the crawl too, e.g. when the request deadline passed
+            if not self.writer.is_closing():
+                self._send({"id": request_id, "cancel": True})
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+        if "error" in response:
+            raise RuntimeError(f"crawler service: {response['error']}")
+        if response["documents"] is None:
+            return None
+        return [Document(page_content=text, metadata=metadata) for text, metadata in response["documents"]]
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+
+
+async def handle_connection(reader, writer, semaphore):
+    import websearch
+    write_lock = asyncio.Lock()
+    tasks = {}
+
+    async def answer(request):
+        try:
+            async with semaphore:
+                docs = await websearch.fetch_documents(request["query"], request["urls"], request.get("k", 5))
+            documents = None if docs is None else [[doc.page_content, doc.metadata] for doc in docs]
+            response = {"id": request["id"], "documents": documents}
+        except Exception as error:
+            logging.error(f"Crawl request failed: {error}")
+            response = {"id": request["id"], "error": str(error)}
+        finally:
+            tasks.pop(request["id"], None)
+        async with write_lock:
+            writer.write((json.dumps(response) + "\n").encode())
+            await writer.drain()
+
+    try:
+        while line := await reader.readline():
+            request = json.loads(line)
+            if request.get("cancel"):
+                task = tasks.pop(request["id"], None)
+                if task is not None:
+                    task.cancel()
+                continue
+            tasks[request["id"]] = asyncio.create_task(answer(request))
+    finally:
+        # The worker went away, nobody will read these answers
+        for task in list(tasks.values()):
+            task.cancel()
+        writer.close()
+
+
+async def serve(address, concurrency):
+    import config
+    import ratelimit
+    import websearch
+    cfg = config.read_config()
+    # Without a shared RATE_LIMIT_DB, workers in service mode leave this share to the service
+    ratelimit.configure(cfg, share=cfg.get('CRAWLER_RATE_SHARE', 0.25))
+    await websearch.init_crawler(mode="local")
+    semaphore = asyncio.Semaphore(concurrency)
+    host, port = parse_address(address)
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, semaphore),
+        host, port, limit=64 * 1024 * 1024
+    )
+    logging.info(f"Crawler service listening on {address}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(os.getenv("CRAWLER_SERVICE_ADDRESS", "127.0.0.1:8765"),
+                      int(os.getenv("CRAWLER_SERVICE_CONCURRENCY", 4))))
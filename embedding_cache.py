@@ -0,0 +1,122 @@
+# embedding_cache.py
+import os
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from providers import get_embedding_client
+from context_builder import count_tokens
+import ratelimit
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed embedding cache: in-memory LRU in front of a SQLite tier"""
+
+    def __init__(self, underlying: Embeddings, path="./embedding_cache.db", memory_items=10000):
+        self.underlying = underlying
+        self.model_name = getattr(underlying, "model", type(underlying).__name__)
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self.db.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def hit_rate(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def _remember(self, key, vector):
+        # float32 arrays: ~6KB per 1536-dim vector instead of ~50KB as a list of floats
+        self.memory[key] = np.asarray(vector, dtype=np.float32)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        """Returns {key: float32 array} for every key found in memory or on disk"""
+        found = {}
+        with self.lock:
+            for key in keys:
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    found[key] = vector
+                    self.stats["memory_hits"] += 1
+
+            pending = [key for key in dict.fromkeys(keys) if key not in found]
+            for start in range(0, len(pending), 500):
+                batch = pending[start:start + 500]
+                rows = self.db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self.stats["disk_hits"] += 1
+        return found
+
+    def _store(self, items):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+            )
+            self.db.commit()
+            for key, vector in items:
+                self._remember(key, vector)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self.key(text) for text in texts]
+        found = self._lookup(keys)
+
+        # Only the misses go to the provider, once per distinct text
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            with self.lock:
+                self.stats["misses"] += len(missing)
+            texts = list(missing.values())
+            vectors = ratelimit.call("embeddings", self.underlying.embed_documents, texts,
+                                     tokens=sum(count_tokens(text) for text in texts))
+            computed = list(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+
+        return [np.asarray(found[key]).tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self.key(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key].tolist()
+        with self.lock:
+            self.stats["misses"] += 1
+        vector = ratelimit.call("embeddings", self.underlying.embed_query, text, tokens=count_tokens(text))
+        self._store([(key, vector)])
+        return vector
+
+
+_shared = None
+
+
+def get_embeddings(path=None) -> CachedEmbeddings:
+    """Returns the process-wide cached embedding client"""
+    global _shared
+    if _shared is None:
+        _shared = CachedEmbeddings(
+            get_embedding_client(),
+            path=path or os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db"),
+            memory_items=int(os.getenv("EMBEDDING_CACHE_ITEMS", 10000))
+        )
+    return _shared
@@ -0,0 +1,191 @@
+# engine.py
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import config
+from embedding_cache import get_embeddings
+from answer_cache import SemanticAnswerCache
+from session_store import SessionStore
+from singleflight import SingleFlight
+from conversation_store import get_store
+from lexical_index import BM25Index
+from retrieval import HybridRetriever, load_reranker
+from context_builder import ContextBuilder
+from providers import get_chat_model
+import ratelimit
+from ratelimit import RateLimitedChatModel
+from metrics import span
+
+DEFAULT_MODEL = "Qwen-Qwq-32b"
+
+
+# API workers behind one uvicorn master; each holds its own engine
+WORKERS = int(os.getenv("WEB_CONCURRENCY", 1))
+
+
+def reserved_rate_shares(cfg) -> dict:
+    """Fraction of each provider's limits the API leaves to other processes, without RATE_LIMIT_DB"""
+    from websearch import CRAWLER_MODE
+    # Ingestion (pdf_processor.py) and the crawler service only call the embeddings API,
+    # with up to INGEST_RATE_SHARE and CRAWLER_RATE_SHARE of it
+    embeddings = cfg.get('INGEST_RATE_SHARE', 0.5)
+    if CRAWLER_MODE == "service":
+        embeddings += cfg.get('CRAWLER_RATE_SHARE', 0.25)
+    return {"embeddings": embeddings}
+
+
+def fresh_chroma_client(path):
+    """Opens path with a new Chroma System, so it sees what other processes wrote since the last open"""
+    import chromadb
+    from chromadb.api.client import SharedSystemClient
+    # Chroma hands out one cached System (segments, HNSW index) per path and process;
+    # clients already open keep theirs until they are dropped
+    SharedSystemClient.clear_system_cache()
+    return chromadb.PersistentClient(path=path)
+
+
+class RAGEngine:
+    """Long-lived holder of config, embeddings, vector store and LLM clients.
+
+    The document collection is only read here; pdf_processor is its single
+    writer and workers pick its changes up through reload_if_changed.
+    """
+
+    def __init__(self, cfg=None):
+        self.cfg = cfg if cfg is not None else config.read_config()
+        # Workers share the provider quotas with each other, ingestion and the crawler service
+        ratelimit.configure(self.cfg, share=1 / WORKERS, reserved=reserved_rate_shares(self.cfg))
+        self.embeddings = get_embeddings(self.cfg.get('embedding_cache_path'))
+        self._llms = {}
+        self._last_check = 0.0
+        self._reload_task = None
+        self.vector_store = None
+        self.retriever = None
+        self.context_builder = ContextBuilder(
+            budget_tokens=self.cfg.get('CONTEXT_TOKEN_BUDGET', 3000),
+            dedup_threshold=self.cfg.get('DEDUP_THRESHOLD', 0.8)
+        )
+        self.answer_cache = SemanticAnswerCache(
+            self.embeddings,
+            threshold=self.cfg.get('ANSWER_CACHE_THRESHOLD', 0.92),
+            ttl=self.cfg.get('ANSWER_CACHE_TTL', 3600),
+            max_items=self.cfg.get('ANSWER_CACHE_ITEMS', 1000)
+        )
+        self.sessions = SessionStore(
+            idle_seconds=self.cfg.get('SESSION_IDLE_SECONDS', 900),
+            max_sessions=self.cfg.get('SESSION_MAX_ITEMS', 10000),
+            shared=WORKERS > 1,
+            # Durable back-end so sessions survive restarts and are shared across workers
+            backend=get_store(self.cfg.get('conversation_db', 'conversations.db'))
+            if self.cfg.get('SESSION_BACKEND', "sqlite") == "sqlite" else None
+        )
+        # Identical questions arriving together share one computation
+        self.coalescer = SingleFlight(max_keys=self.cfg.get('COALESCE_MAX_KEYS', 1000))
+        self._signature = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.cfg.get('BLOCKING_WORKERS', 16),
+            thread_name_prefix="rag-blocking"
+        )
+        self._open_vector_store()
+
+    def install_executor(self, loop=None):
+        """Makes the bounded pool the loop's default, so to_thread calls share it"""
+        loop = loop or asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+
+    @property
+    def persist_directory(self):
+        return os.path.join(self.cfg['chroma_base_dir'], self.cfg['chroma_collection'])
+
+    def _collection_signature(self):
+        """Returns the mtimes of the Chroma sqlite file and lexical index, used to detect re-ingestion"""
+        signature = []
+        for path in (os.path.join(self.persist_directory, "chroma.sqlite3"),
+                     os.path.join(self.lexical_index_dir, "terms.json")):
+            try:
+                signature.append(os.path.getmtime(path))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _open_vector_store(self):
+        """Opens the collection and swaps it in; blocking, so run off the event loop once serving"""
+        from langchain_community.vectorstores import Chroma
+        signature = self._collection_signature()
+        with span("chroma_open"):
+            vector_store = Chroma(
+                client=fresh_chroma_client(self.persist_directory),
+                collection_name=self.cfg['chroma_collection'],
+                embedding_function=self.embeddings,
+            )
+            retriever = self._make_retriever(vector_store)
+        # Requests in flight keep the retriever they already hold
+        self.vector_store, self.retriever = vector_store, retriever
+        self._signature = signature
+        # Answers generated from the previous collection are no longer valid
+        if self.answer_cache.namespaces:
+            self.answer_cache.invalidate()
+        logging.info(f"Opened collection {self.cfg['chroma_collection']} at {self.persist_directory}")
+
+    @property
+    def lexical_index_dir(self):
+        return os.path.join(self.persist_directory, "lexical_index")
+
+    def _make_retriever(self, vector_store):
+        k = self.cfg.get('RETRIEVER_K', 5)
+        if not self.cfg.get('HYBRID_RETRIEVAL', False) or not BM25Index.exists(self.lexical_index_dir):
+            return vector_store.as_retriever(search_kwargs={"k": k})
+        return HybridRetriever(
+            vector_store,
+            BM25Index.load(self.lexical_index_dir),
+            k=k,
+            fetch_k=self.cfg.get('HYBRID_FETCH_K', 20),
+            vector_weight=self.cfg.get('VECTOR_WEIGHT', 0.5),
+            lexical_weight=self.cfg.get('LEXICAL_WEIGHT', 0.5),
+            reranker=load_reranker(self.cfg.get('RERANKER'))
+        )
+
+    def get_llm(self, model_name=DEFAULT_MODEL):
+        """Returns a shared chat client so its HTTP connection pool is reused"""
+        llm = self._llms.get(model_name)
+        if llm is None:
+            llm = RateLimitedChatModel(get_chat_model(model_name))
+            self._llms[model_name] = llm
+        return llm
+
+    async def aretrieve(self, query):
+        """Retrieves documents off the event loop; Chroma has no async API"""
+        retriever = self.retriever
+        return await asyncio.to_thread(retriever.get_relevant_documents, query)
+
+    def reload(self):
+        """Re-reads config and reopens the vector store"""
+        self.cfg = config.read_config()
+        ratelimit.configure(self.cfg, share=1 / WORKERS, reserved=reserved_rate_shares(self.cfg))
+        self._open_vector_store()
+
+    def reload_if_changed(self):
+        """Starts reopening the vector store in the background when the collection on disk has changed"""
+        interval = self.cfg.get('RELOAD_CHECK_SECONDS', 30)
+        now = time.monotonic()
+        if now - self._last_check < interval:
+            return False
+        self._last_check = now
+
+        if self._reload_task is not None and not self._reload_task.done():
+            return False
+        signature = self._collection_signature()
+        if signature == self._signature:
+            return False
+        logging.info("Collection changed on disk, reloading vector store")
+        # Requests keep being served from the old collection until the new one is swapped in
+        self._reload_task = asyncio.create_task(asyncio.to_thread(self._open_vector_store))
+        self._reload_task.add_done_callback(self._reload_done)
+        return True
+
+    @staticmethod
+    def _reload_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Vector store reload failed: {task.exception()}")
@@ -0,0 +1,124 @@
+# lexical_index.py
+import os
+import re
+import json
+import math
+import logging
+from collections import defaultdict
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """BM25 over the collection's chunks, stored as flat arrays that are memory-mapped on load"""
+
+    def __init__(self, chunk_ids, vocabulary, postings, frequencies, doc_lengths, k1=1.5, b=0.75):
+        self.chunk_ids = chunk_ids
+        self.vocabulary = vocabulary  # term -> [offset, count] into postings/frequencies
+        self.postings = postings
+        self.frequencies = frequencies
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, chunks):
+        """Builds the index from an iterable of (chunk_id, text)"""
+        chunk_ids = []
+        doc_lengths = []
+        term_postings = defaultdict(list)
+        for doc_index, (chunk_id, text) in enumerate(chunks):
+            tokens = tokenize(text)
+            chunk_ids.append(chunk_id)
+            doc_lengths.append(len(tokens))
+            counts = defaultdict(int)
+            for token in tokens:
+                counts[token] += 1
+            for token, count in counts.items():
+                term_postings[token].append((doc_index, count))
+
+        vocabulary = {}
+        postings = []
+        frequencies = []
+        for term, entries in term_postings.items():
+            vocabulary[term] = [len(postings), len(entries)]
+            postings.extend(doc for doc, _ in entries)
+            frequencies.extend(count for _, count in entries)
+
+        return cls(
+            chunk_ids,
+            vocabulary,
+            np.asarray(postings, dtype=np.int32),
+            np.asarray(frequencies, dtype=np.float32),
+            np.asarray(doc_lengths, dtype=np.float32),
+        )
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, "postings.npy"), self.postings)
+        np.save(os.path.join(index_dir, "frequencies.npy"), self.frequencies)
+        np.save(os.path.join(index_dir, "doc_lengths.npy"), self.doc_lengths)
+        with open(os.path.join(index_dir, "terms.json"), "w") as f:
+            json.dump({"chunk_ids": self.chunk_ids, "vocabulary": self.vocabulary}, f)
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, "terms.json"), "r") as f:
+            terms = json.load(f)
+        return cls(
+            terms["chunk_ids"],
+            terms["vocabulary"],
+            np.load(os.path.join(index_dir, "postings.npy"), mmap_mode="r"),
+            np.load(os.path.join(index_dir, "frequencies.npy"), mmap_mode="r"),
+            np.load(os.path.join(index_dir, "doc_lengths.npy"), mmap_mode="r"),
+        )
+
+    @staticmethod
+    def exists(index_dir):
+        return os.path.exists(os.path.join(index_dir, "terms.json"))
+
+    def search(self, query, k=20):
+        """Returns [(chunk_id, score)] for the top k chunks"""
+        total = len(self.chunk_ids)
+        if not total:
+            return []
+        scores = np.zeros(total, dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self.vocabulary.get(term)
+            if entry is None:
+                continue
+            offset, count = entry
+            docs = self.postings[offset:offset + count]
+            tf = self.frequencies[offset:offset + count]
+            idf = math.log(1 + (total - count + 0.5) / (count + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_length)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        k = min(k, total)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk_ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+def build_from_collection(db_instance, index_dir, page_size=1000):
+    """Rebuilds the lexical index from every chunk stored in the Chroma collection"""
+    def iter_chunks():
+        offset = 0
+        while True:
+            page = db_instance.get(include=["documents"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                return
+            yield from zip(page["ids"], page["documents"])
+            offset += len(page["ids"])
+
+    index = BM25Index.build(iter_chunks())
+    index.save(index_dir)
+    logging.info(f"Built lexical index over {len(index.chunk_ids)} chunks in {index_dir}")
+    return index
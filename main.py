@@ -1,58 +1,46 @@
 # main.py
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
-import os
+from typing import Optional
+import time
+import asyncio
+import hashlib
+import logging
 from dotenv import load_dotenv
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_groq import ChatGroq
 import config
-from websearch import get_info
+from engine import RAGEngine, WORKERS
+from streaming import ThinkFilter, ndjson
+from context_builder import count_tokens, WORD_PATTERN
+import metrics
+from metrics import span
+import ratelimit
+from ratelimit import Overloaded
+from websearch import get_info, get_web_documents, WEB_FALLBACK_ANSWERS
 import re
 
 load_dotenv()
 
 app = FastAPI()
 
+# Created once in the startup hook and shared by every request
+engine: RAGEngine = None
+
 
 class QueryRequest(BaseModel):
     query: str
     use_web_search: bool = False
-    conversation_history: list = []
-
-
-def get_rag_answer(query: str, conversation_history: list = []):
-    cfg = config.read_config()
-
-    embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-    vector_store = Chroma(
-        collection_name=cfg['chroma_collection'],
-        embedding_function=embeddings,
-        persist_directory=os.path.join(cfg['chroma_base_dir'], cfg['chroma_collection'])
-    )
-
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-    docs = retriever.get_relevant_documents(query)
+    session_id: Optional[str] = None  # history is kept server-side per session
+    conversation_history: list = []  # deprecated: full client-side history, used instead of the session when sent
+    combined_mode: Optional[str] = None  # "single" or "multi", defaults to COMBINED_MODE
+    debug: bool = False  # include the per-stage timings in the response
+    email: Optional[str] = None  # owner of the session in the conversation store
 
-    if not docs:
-        return "I couldn't find relevant information in the documents."
 
-    context = "\n\n".join([doc.page_content for doc in docs])
+NO_DOCUMENTS_ANSWER = "I couldn't find relevant information in the documents."
+FAILURE_ANSWER = "Sorry, I couldn't process the query."
 
-    llm = ChatGroq(
-        groq_api_key=os.getenv("GROQ_API_KEY"),
-        model_name="Qwen-Qwq-32b"
-    )
-
-    # Format conversation history
-    history_str = ""
-    if conversation_history:
-        history_str = "\n\nPrevious conversation:\n"
-        history_str += "\n".join([f"{'User' if i%2==0 else 'Assistant'}: {msg}" 
-                                for i, msg in enumerate(conversation_history[-6:])])  # Keep last 3 exchanges
-
-    prompt = f"""
-* Important Notes for the Virtual Assistant  
+ASSISTANT_INSTRUCTIONS = """* Important Notes for the Virtual Assistant  
 - You are a virtual assistant for students at Ca' Foscari University of Venice.  
 - Your role is to provide clear, accurate, and helpful answers based only on the official context provided (from university documents and communications).   
 - You will be given a history of your conversation with the user, which will help inform your response. Always consider the history provided to ensure continuity and relevance in your response.   
@@ -71,7 +59,93 @@ def get_rag_answer(query: str, conversation_history: list = []):
 - If the answer is not available, say: "I'm really sorry, but I don't have the exact information."  
 - Recommend the student contact the appropriate university office for further details. If contact details (such as an email or phone number) are available, provide them to help the student reach the right department.
 * **Review the Response**:  
-- After generating the answer, re-read your response to check if there are any ambiguous terms or areas where clarity might be needed. If any terms might confuse the student, make sure to explain them.
+- After generating the answer, re-read your response to check if there are any ambiguous terms or areas where clarity might be needed. If any terms might confuse the student, make sure to explain them."""
+
+
+def format_history(messages: list, summary: str = "") -> str:
+    """Formats the running summary and (role, content) messages, dropping the oldest beyond the history token budget"""
+    if not messages and not summary:
+        return ""
+    summary_line = f"Summary of earlier conversation: {summary}" if summary else ""
+    budget = engine.cfg.get('HISTORY_TOKEN_BUDGET', 1500) - count_tokens(summary_line)
+    lines = [f"{'User' if role == 'user' else 'Assistant'}: {content}" for role, content in messages]
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > budget:
+        lines.pop(0)
+    if summary_line:
+        lines.insert(0, summary_line)
+    return "\n\nPrevious conversation:\n" + "\n".join(lines)
+
+
+def load_history(request: QueryRequest):
+    """Returns (session, formatted history, cacheable); session is None for clients sending their own history"""
+    if request.conversation_history:
+        messages = [("user" if i % 2 == 0 else "assistant", msg)
+                    for i, msg in enumerate(request.conversation_history[-6:])]  # Keep last 3 exchanges
+        return None, format_history(messages), len(request.conversation_history) <= 1
+
+    session = engine.sessions.get(request.session_id, request.email)
+    with engine.sessions.lock:
+        # Turns still waiting to be summarised stay in the prompt until they are
+        messages = session.overflow + session.messages
+        summary = session.summary
+    # Follow-up questions depend on the history, only standalone ones are cached
+    return session, format_history(messages, summary), session.is_new
+
+
+async def summarize_history(summary: str, messages: list) -> str:
+    """Folds older turns into the running summary, capped at SESSION_SUMMARY_TOKENS"""
+    # Runs in its own task after the response: yield the LLM quota to waiting requests
+    ratelimit.current_priority.set(ratelimit.BACKGROUND)
+    limit = engine.cfg.get('SESSION_SUMMARY_TOKENS', 300)
+    turns = "\n".join(f"{'User' if role == 'user' else 'Assistant'}: {content}" for role, content in messages)
+    prompt = f"""Update the running summary of a conversation between a student and the Ca' Foscari virtual assistant.
+Keep the student's goals, the facts already given and any open questions, in at most {limit * 3 // 4} words.
+
+Current summary: {summary or "None"}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+    with span("llm_summary"):
+        response = await engine.get_llm().ainvoke(prompt)
+    metrics.record_tokens("summary", count_tokens(prompt), count_tokens(response.content))
+    text = re.sub(r"<think>.*?</think>", "", response.content, flags=re.DOTALL).strip()
+    # Hard cap, so the history part of the prompt stays constant whatever the model returns
+    if count_tokens(text) > limit:
+        text = text[:limit * 4]
+    return text
+
+
+# Summaries run after the response; references keep the tasks alive until done
+background_tasks = set()
+
+
+async def remember_turn(session, query: str, answer: str):
+    """Records the turn in the session and compacts older turns in the background"""
+    if session is None:
+        return
+    await asyncio.to_thread(engine.sessions.record, session, query, answer)
+    if session.overflow:
+        task = asyncio.create_task(engine.sessions.compact(session, summarize_history))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+async def build_rag_prompt(query: str, history_str: str = ""):
+    """Retrieves context and returns the RAG prompt, or None when nothing was found"""
+    with span("retrieval"):
+        docs = await engine.aretrieve(query)
+
+    if not docs:
+        return None
+
+    with span("context_build"):
+        context, context_stats = engine.context_builder.build(docs)
+
+    prompt = f"""
+{ASSISTANT_INSTRUCTIONS}
 
 
 1- History Conversation: {history_str}
@@ -82,23 +156,62 @@ Question: {query}
 
 Answer:"""
 
-    response = llm.invoke(prompt)
+    logging.info(f"RAG prompt: {count_tokens(prompt)} tokens, context {context_stats}")
+    return prompt
+
+
+async def get_rag_answer(query: str, history_str: str = ""):
+    prompt = await build_rag_prompt(query, history_str)
+    if prompt is None:
+        return NO_DOCUMENTS_ANSWER
+
+    with span("llm_rag"):
+        response = await engine.get_llm().ainvoke(prompt)
+    metrics.record_tokens("rag", count_tokens(prompt), count_tokens(response.content))
     cleaned_content = re.sub(r"<think>.*?</think>", "", response.content, flags=re.DOTALL)
 
     return cleaned_content
 
 
-async def get_combined_answer(query: str, conversation_history: list = []):
-    rag_response = get_rag_answer(query, conversation_history)
-    web_response = await get_info(query)
-    
-    # Format conversation history
-    history_str = ""
-    if conversation_history:
-        history_str = "\n\nPrevious conversation:\n"
-        history_str += "\n".join([f"{'User' if i%2==0 else 'Assistant'}: {msg}" 
-                                for i, msg in enumerate(conversation_history[-6:])])  # Keep last 3 exchanges
-    
+async def run_branch(name: str, coro, timeout: float):
+    """Awaits one answer branch, returning None if it fails or misses its timeout"""
+    stage = name.lower().replace(" ", "_") + "_branch"
+    try:
+        with span(stage):
+            return await asyncio.wait_for(coro, timeout=max(timeout, 0))
+    except asyncio.TimeoutError:
+        logging.warning(f"{name} branch timed out after {timeout:.1f}s")
+        metrics.inc("branch_timeouts_total", help_text="Answer branches that missed their timeout", branch=stage)
+    except Exception as error:
+        logging.error(f"{name} branch failed: {error}")
+        metrics.inc("branch_errors_total", help_text="Answer branches that raised", branch=stage)
+    return None
+
+
+async def build_combined_prompt(query: str, history_str: str, deadline: float):
+    """Runs both branches and returns (merging prompt, fallback answer, degraded).
+
+    The prompt is None when a branch is missing and the fallback should be used as is.
+    degraded is set when a branch failed or timed out, so the answer must not be cached.
+    """
+    cfg = engine.cfg
+    # Leave room for the final merging call inside the request deadline
+    branch_budget = deadline - time.monotonic() - cfg.get('COMBINE_RESERVE_SECONDS', 15)
+
+    rag_response, web_response = await asyncio.gather(
+        run_branch("RAG", get_rag_answer(query, history_str),
+                   min(cfg.get('RAG_TIMEOUT_SECONDS', 30), branch_budget)),
+        run_branch("Web", get_info(query),
+                   min(cfg.get('WEB_TIMEOUT_SECONDS', 30), branch_budget)),
+    )
+
+    if web_response is None:
+        return None, rag_response or FAILURE_ANSWER, True
+    if rag_response is None:
+        return None, web_response, True
+    # The web branch answered with its own fallback: merging it gives a partial answer
+    degraded = web_response in WEB_FALLBACK_ANSWERS
+
     combined_context = f"""
 You are a virtual assistant for students at Ca' Foscari University of Venice. Your task is to provide clear, accurate, and helpful answers based only on the university’s official documents, communications, and available web search information.
 
@@ -122,11 +235,6 @@ Now, based on thse information, answer the following question:
 Question: {query}
 """
     
-    llm = ChatGroq(
-        groq_api_key=os.getenv("GROQ_API_KEY"),
-        model_name="Qwen-Qwq-32b"
-    )
-    
     final_prompt = f"""
     Based on the information provided from conversaation history, the RAG response and the web search response, please answer the following question:
     
@@ -134,23 +242,294 @@ Question: {query}
     
     Answer the question concisely by combining all the pieces of information:
     """
-    
-    response = llm.invoke(final_prompt)
+    logging.info(f"Combined prompt: {count_tokens(final_prompt)} tokens")
+    return final_prompt, rag_response, degraded
+
+
+async def build_grounded_prompt(query: str, history_str: str, deadline: float):
+    """Retrieves PDF and web chunks concurrently and returns (single grounded prompt, fallback answer, degraded)"""
+    cfg = engine.cfg
+    branch_budget = deadline - time.monotonic() - cfg.get('COMBINE_RESERVE_SECONDS', 15)
+
+    pdf_docs, web_docs = await asyncio.gather(
+        run_branch("RAG retrieval", engine.aretrieve(query),
+                   min(cfg.get('RAG_TIMEOUT_SECONDS', 30), branch_budget)),
+        run_branch("Web retrieval", get_web_documents(query),
+                   min(cfg.get('WEB_TIMEOUT_SECONDS', 30), branch_budget)),
+    )
+    # A branch that failed or timed out, a failed search or crawl return None; an empty search returns []
+    degraded = pdf_docs is None or web_docs is None
+    pdf_docs = pdf_docs or []
+    web_docs = web_docs or []
+    if not pdf_docs and not web_docs:
+        return None, NO_DOCUMENTS_ANSWER, degraded
+
+    # University documents come first; web chunks fill the rest of the budget
+    # and are dropped when they repeat what the documents already say
+    budget = cfg.get('CONTEXT_TOKEN_BUDGET', 3000)
+    web_reserve = cfg.get('WEB_CONTEXT_MIN_TOKENS', 800) if web_docs else 0
+    pdf_context, pdf_stats = engine.context_builder.build(pdf_docs, budget_tokens=budget - web_reserve)
+    web_context, web_stats = engine.context_builder.build(
+        web_docs,
+        reference_texts=[pdf_context] if pdf_context else (),
+        budget_tokens=budget - pdf_stats["context_tokens"]
+    )
+
+    prompt = f"""
+{ASSISTANT_INSTRUCTIONS}
+- The university documents are your primary source. Use the web search results only to complete or update them, preferring official unive.it pages.
+
+
+1- History Conversation: {history_str}
+
+2- University Documents: {pdf_context or "No relevant documents found."}
+
+3- Web Search Results: {web_context or "No relevant web results found."}
+
+Question: {query}
+
+Answer:"""
+
+    logging.info(f"Grounded prompt: {count_tokens(prompt)} tokens, documents {pdf_stats}, web {web_stats}")
+    return prompt, FAILURE_ANSWER, degraded
+
+
+async def build_web_prompt(query: str, history_str: str, deadline: float, mode: str = None):
+    """Dispatches web-search mode: one grounded call ("single") or the three-call merge ("multi")"""
+    mode = mode or engine.cfg.get('COMBINED_MODE', "single")
+    if mode == "multi":
+        return await build_combined_prompt(query, history_str, deadline)
+    return await build_grounded_prompt(query, history_str, deadline)
+
+
+async def get_combined_answer(query: str, history_str: str = "", mode: str = None):
+    """Returns (answer, degraded); degraded answers are fallbacks and must not be cached"""
+    deadline = time.monotonic() + engine.cfg.get('REQUEST_DEADLINE_SECONDS', 60)
+    final_prompt, rag_response, degraded = await build_web_prompt(query, history_str, deadline, mode)
+    if final_prompt is None:
+        return rag_response, degraded
+
+    llm = engine.get_llm()
+    try:
+        with span("llm_final"):
+            response = await asyncio.wait_for(llm.ainvoke(final_prompt), timeout=max(deadline - time.monotonic(), 0))
+    except asyncio.TimeoutError:
+        logging.warning("Final call missed the request deadline, using the fallback answer")
+        return rag_response, True
+    metrics.record_tokens(mode or engine.cfg.get('COMBINED_MODE', "single"),
+                          count_tokens(final_prompt), count_tokens(response.content))
     cleaned_content = re.sub(r"<think>.*?</think>", "", response.content, flags=re.DOTALL)
-    return cleaned_content
+    return cleaned_content, degraded
+
+
+def coalesce_key(kind: str, request: QueryRequest, history_str: str) -> tuple:
+    """Requests share a computation when the normalized query, mode and history all match"""
+    mode = (request.combined_mode or engine.cfg.get('COMBINED_MODE', "single")) if request.use_web_search else "rag"
+    query = " ".join(WORD_PATTERN.findall(request.query.lower()))
+    return kind, mode, query, hashlib.sha256(history_str.encode("utf-8")).hexdigest()
+
+
+async def coalesced(kind: str, request: QueryRequest, history_str: str, factory):
+    if not engine.cfg.get('COALESCE_REQUESTS', True):
+        return await factory()
+    return await engine.coalescer.do(coalesce_key(kind, request, history_str), factory)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, error: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(int(error.retry_after + 0.999))}
+    )
 
 
 @app.post("/ask")
 async def ask_question(request: QueryRequest):
-    if request.use_web_search:
-        answer = await get_combined_answer(request.query, request.conversation_history)
+    start = time.monotonic()
+    session, history_str, cacheable = await asyncio.to_thread(load_history, request)
+    namespace = "web" if request.use_web_search else "rag"
+    engine.reload_if_changed()
+
+    trace = metrics.current_trace.get()
+
+    cached = await lookup_answer(request, cacheable)
+    if cached is not None:
+        await remember_turn(session, request.query, cached)
+        return with_timings({"answer": cached, "cached": True, "session_id": session and session.session_id},
+                            request, trace)
+
+    # Shed load before doing any work when the LLM queue is already full; cache hits need no LLM
+    ratelimit.get_limiter("llm").check()
+
+    async def answer_question():
+        if request.use_web_search:
+            answer, degraded = await get_combined_answer(request.query, history_str, request.combined_mode)
+        else:
+            answer, degraded = await get_rag_answer(request.query, history_str), False
+        # Fallbacks after a failure or timeout would be served long after the cause is gone
+        if cacheable and not degraded:
+            await engine.answer_cache.astore(request.query, namespace, answer, time.monotonic() - start)
+        return answer
+
+    answer = await coalesced("answer", request, history_str, answer_question)
+    await remember_turn(session, request.query, answer)
+    metrics.observe("ask_request_seconds", time.monotonic() - start, "End-to-end /ask latency", mode=namespace)
+    return with_timings({"answer": answer, "session_id": session and session.session_id}, request, trace)
+
+
+async def lookup_answer(request: QueryRequest, cacheable: bool):
+    """Returns the cached answer for a standalone question, or None"""
+    if not cacheable:
+        return None
+    with span("answer_cache_lookup"):
+        return await engine.answer_cache.alookup(request.query, "web" if request.use_web_search else "rag")
+
+
+def with_timings(body: dict, request: QueryRequest, trace: list) -> dict:
+    if request.debug and trace is not None:
+        body["timings"] = {stage: round(elapsed * 1000, 1) for stage, elapsed in trace}
+    return body
+
+
+async def stream_events(request: QueryRequest, start: float, session, history_str: str, cacheable: bool,
+                        cached, trace: list):
+    """Yields NDJSON token events with only the visible answer, then a done event"""
+    session_id = session and session.session_id
+    namespace = "web" if request.use_web_search else "rag"
+    # The body is sent after the handler returned: keep adding to the same trace
+    metrics.current_trace.set(trace)
+
+    if cached is not None:
+        yield ndjson({"type": "token", "text": cached})
+        await remember_turn(session, request.query, cached)
+        yield ndjson({"type": "done", "cached": True, "ttft": time.monotonic() - start, "session_id": session_id})
+        return
+
+    async def prepare_prompt():
+        if request.use_web_search:
+            deadline = time.monotonic() + engine.cfg.get('REQUEST_DEADLINE_SECONDS', 60)
+            return await build_web_prompt(request.query, history_str, deadline, request.combined_mode)
+        return await build_rag_prompt(request.query, history_str), NO_DOCUMENTS_ANSWER, False
+
+    # Each client streams its own generation; retrieval and web search are shared
+    prompt, fallback, degraded = await coalesced("prompt", request, history_str, prepare_prompt)
+
+    ttft = None
+    parts = []
+    if prompt is None:
+        ttft = time.monotonic() - start
+        parts.append(fallback)
+        yield ndjson({"type": "token", "text": fallback})
     else:
-        answer = get_rag_answer(request.query, request.conversation_history)
-    return {"answer": answer}
-
+        think = ThinkFilter()
+        streamed = 0
+        with span("llm_stream"):
+            async for chunk in engine.get_llm().astream(prompt):
+                streamed += count_tokens(chunk.content)
+                text = think.feed(chunk.content)
+                if text:
+                    if ttft is None:
+                        ttft = time.monotonic() - start
+                    parts.append(text)
+                    yield ndjson({"type": "token", "text": text})
+        metrics.record_tokens("stream", count_tokens(prompt), streamed)
+        tail = think.flush()
+        if tail:
+            parts.append(tail)
+            yield ndjson({"type": "token", "text": tail})
+
+    total = time.monotonic() - start
+    answer = "".join(parts)
+    logging.info(f"Streamed answer: ttft={ttft if ttft is None else round(ttft, 3)}s total={total:.3f}s")
+    if cacheable and answer and not degraded:
+        await engine.answer_cache.astore(request.query, namespace, answer, total)
+    await remember_turn(session, request.query, answer)
+    if ttft is not None:
+        metrics.observe("ask_first_token_seconds", ttft, "Time to first visible streamed token", mode=namespace)
+    metrics.observe("ask_request_seconds", total, "End-to-end /ask latency", mode=namespace)
+    yield ndjson(with_timings({"type": "done", "cached": False, "ttft": ttft, "total": total,
+                               "session_id": session_id}, request, trace))
+
+
+async def stream_or_shed(*args):
+    """Ends the stream with an overloaded event when a provider sheds the request after it started"""
+    try:
+        async for event in stream_events(*args):
+            yield event
+    except Overloaded as error:
+        yield ndjson({"type": "error", "error": "overloaded", "retry_after": error.retry_after})
+
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QueryRequest):
+    start = time.monotonic()
+    session, history_str, cacheable = await asyncio.to_thread(load_history, request)
+    engine.reload_if_changed()
+    trace = metrics.start_trace()
+    cached = await lookup_answer(request, cacheable)
+    if cached is None:
+        # Shedding here still gets a real 503, before the stream has started; cache hits need no LLM
+        ratelimit.get_limiter("llm").check()
+    return StreamingResponse(stream_or_shed(request, start, session, history_str, cacheable, cached, trace),
+                             media_type="application/x-ndjson")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    cache = engine.answer_cache
+    stats = {
+        "answer_cache": {**cache.stats, "hit_ratio": cache.hit_ratio()},
+        "embedding_cache": {**engine.embeddings.stats, "hit_rate": engine.embeddings.hit_rate()},
+        "coalescing": {**engine.coalescer.stats, "in_flight": len(engine.coalescer)},
+    }
+    # In service mode the crawl cache lives in the crawler service
+    if crawl_cache_stats() is not None:
+        stats["crawl_cache"] = crawl_cache_stats()
+    return stats
+
+
+from websearch import init_crawler, crawl_cache_stats
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Collects stage timings per request; X-Debug-Trace returns them as a header"""
+    trace = metrics.start_trace()
+    response = await call_next(request)
+    if request.headers.get("x-debug-trace"):
+        response.headers["X-Stage-Timings"] = metrics.format_trace(trace)
+    return response
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def cache_counters():
+    counters = []
+    for cache_name, stats in (("answer", engine.answer_cache.stats),
+                              ("embedding", engine.embeddings.stats),
+                              ("crawl", crawl_cache_stats() or {})):
+        for key, value in stats.items():
+            counters.append((f"cache_{key}_total", {"cache": cache_name}, value))
+    # "coalesced" counts the upstream computations saved by single-flight
+    for outcome, value in engine.coalescer.stats.items():
+        counters.append(("request_coalescing_total", {"outcome": outcome}, value))
+    return counters
+
+@app.post("/admin/reload")
+async def reload_engine():
+    await asyncio.to_thread(engine.reload)
+    return {"status": "reloaded", "collection": engine.cfg['chroma_collection']}
 
-from websearch import init_crawler
 
 @app.on_event("startup")
 async def startup_event():
-    await init_crawler()
\ No newline at end of file
+    global engine
+    engine = RAGEngine(config.read_config())
+    engine.install_executor()
+    metrics.register_collector(cache_counters)
+    metrics.register_collector(ratelimit.limiter_counters)
+    await init_crawler(workers=WORKERS)
\ No newline at end of file
@@ -0,0 +1,113 @@
+# metrics.py
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters = {}    # (name, labels) -> value
+_help = {}
+_collectors = []
+
+# Stage timings of the current request, when tracing is on
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def observe(name: str, value: float, help_text: str = "", **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0] * (len(DEFAULT_BUCKETS) + 1) + [0.0]
+            _help.setdefault(name, help_text)
+        series[bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        series[-1] += value
+
+
+def inc(name: str, value: float = 1, help_text: str = "", **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        _help.setdefault(name, help_text)
+
+
+@contextmanager
+def span(stage: str):
+    """Times a stage into the stage histogram and the current request trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("rag_stage_seconds", elapsed, "Time spent per /ask stage", stage=stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+def record_tokens(call: str, prompt_tokens: int, completion_tokens: int):
+    inc("llm_prompt_tokens_total", prompt_tokens, "Prompt tokens sent per LLM call type", call=call)
+    inc("llm_completion_tokens_total", completion_tokens, "Completion tokens received per LLM call type", call=call)
+    inc("llm_calls_total", 1, "LLM calls per call type", call=call)
+
+
+def register_collector(collector):
+    """collector() returns [(name, labels, value)] counters read at scrape time, e.g. cache stats"""
+    _collectors.append(collector)
+
+
+def start_trace() -> list:
+    trace = []
+    current_trace.set(trace)
+    return trace
+
+
+def format_trace(trace: list) -> str:
+    """Stage breakdown as a Server-Timing style header value"""
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in trace)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def render() -> str:
+    """Prometheus text exposition of every histogram and counter"""
+    with _lock:
+        histograms = {key: list(series) for key, series in _histograms.items()}
+        counters = dict(_counters)
+    for collector in _collectors:
+        for name, labels, value in collector():
+            counters[(name, _labels(labels))] = value
+
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {name} {_help.get(name, '')}")
+        lines.append(f"# TYPE {name} histogram")
+        for (series_name, labels), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(DEFAULT_BUCKETS + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {series[-1]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {name} {_help.get(name, '')}")
+        lines.append(f"# TYPE {name} counter")
+        for (series_name, labels), value in sorted(counters.items()):
+            if series_name == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,52 +1,234 @@
 #pdf_processor.py
 import logging
 import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader
-from langchain.schema import Document
 import config
-from vectordatabase import store_documents
+import ratelimit
+from vectordatabase import open_collection, make_splitter, write_batches
+from lexical_index import build_from_collection
 
-def get_pdf_content(file_path):
-    """Extracts and combines text content from PDF pages"""
-    pdf_loader = PyPDFLoader(file_path)
-    document_pages = pdf_loader.load_and_split()
-    logging.debug(f"Extracted {len(document_pages)} pages from {file_path}")
-    return "\n\n".join([page.page_content.strip() for page in document_pages])
+MANIFEST_NAME = "ingest_manifest.json"
+
+def current_rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss / (1 << 20)
+        except ImportError:
+            return 0.0
+
+def iter_pdf_pages(file_path):
+    """Yields one Document per PDF page, keeping its source and page number"""
+    page_count = 0
+    for page in PyPDFLoader(file_path).lazy_load():
+        page.metadata["source"] = file_path
+        page_count += 1
+        yield page
+    logging.debug(f"Extracted {page_count} pages from {file_path}")
+
+def iter_chunks(file_path, splitter):
+    """Splits a PDF page by page, so only one page of text is held at a time"""
+    for page in iter_pdf_pages(file_path):
+        if page.page_content.strip():
+            yield from splitter.split_documents([page])
+
+def iter_batches(chunks, batch_limit, max_bytes=None):
+    """Groups chunks into batches of at most batch_limit chunks and max_bytes of text"""
+    batch = []
+    batch_bytes = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        batch_bytes += len(chunk.page_content.encode("utf-8"))
+        if len(batch) >= batch_limit or (max_bytes and batch_bytes >= max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
 
 def handle_pdf_processing(input_dir, output_dir, collection_name, config_settings):
-    """Processes PDF files and stores them in vector database"""
-    processed_docs = []
-    
+    """Streams every PDF through split, embed and write in bounded batches, upserting by stable id.
+
+    Records the same manifest as the incremental mode, so either mode can follow the other.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    db_instance = open_collection(output_dir, collection_name)
+    splitter = make_splitter(config_settings['CHUNK_SIZE'], config_settings['CHUNK_OVERLAP'])
+    max_bytes = config_settings.get('INGEST_BATCH_MAX_BYTES')
+    file_count = 0
+    chunk_count = 0
+    seen = set()
+
     for filename in os.listdir(input_dir):
         if not filename.lower().endswith('.pdf'):
             continue
             
         full_path = os.path.join(input_dir, filename)
+        seen.add(full_path)
+        stat = os.stat(full_path)
+        written = 0
         try:
-            extracted_text = get_pdf_content(full_path)
-            doc = Document(
-                page_content=extracted_text,
-                metadata={"source": full_path}
-            )
-            processed_docs.append(doc)
+            for batch in iter_batches(iter_chunks(full_path, splitter), config_settings['BATCH_SIZE'], max_bytes):
+                write_batches(db_instance, batch, len(batch),
+                              ids=chunk_ids(full_path, written + len(batch), start=written))
+                written += len(batch)
+            remove_trailing_chunks(db_instance, manifest, full_path, written)
+            manifest[full_path] = {"mtime": stat.st_mtime, "size": stat.st_size,
+                                   "sha256": file_sha256(full_path), "chunks": written}
+            save_manifest(manifest_path, manifest)
+            chunk_count += written
+            file_count += 1
             logging.info(f"Processed {full_path}")
         except Exception as error:
             logging.error(f"Failed processing {filename}: {error}")
             raise
 
-    store_documents(
-        db_path=output_dir,
-        collection=collection_name,
-        docs=processed_docs,
-        chunk_size=config_settings['CHUNK_SIZE'],
-        chunk_overlap=config_settings['CHUNK_OVERLAP'],
-        batch_limit=config_settings['BATCH_SIZE'],
-        delay=config_settings['SLEEP_SECONDS']
-    )
-    logging.info(f"Stored {len(processed_docs)} documents in {collection_name}")
+    for source in [source for source in manifest if source not in seen]:
+        db_instance.delete(ids=chunk_ids(source, manifest[source]["chunks"]))
+        del manifest[source]
+        logging.info(f"Removed chunks of deleted file {source}")
+    save_manifest(manifest_path, manifest)
+
+    db_instance.persist()
+    build_from_collection(db_instance, os.path.join(output_dir, "lexical_index"))
+    logging.info(f"Stored {chunk_count} chunks from {file_count} documents in {collection_name}")
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_ids(source, count, start=0):
+    """Stable chunk ids: the same source and position always map to the same id"""
+    prefix = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+    return [f"{prefix}-{i}" for i in range(start, count)]
+
+def remove_trailing_chunks(db_instance, manifest, source, count):
+    """Drops chunks left over from a longer previous version of source"""
+    previous_count = manifest.get(source, {}).get("chunks", 0)
+    if previous_count > count:
+        db_instance.delete(ids=chunk_ids(source, previous_count, start=count))
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def save_manifest(manifest_path, manifest):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def detect_changes(input_dir, manifest):
+    """Returns (changed files with their fingerprints, deleted sources)"""
+    changed = {}
+    seen = set()
+    for filename in os.listdir(input_dir):
+        if not filename.lower().endswith('.pdf'):
+            continue
+        full_path = os.path.join(input_dir, filename)
+        seen.add(full_path)
+        stat = os.stat(full_path)
+        previous = manifest.get(full_path)
+        # Only hash files whose mtime or size moved
+        if previous and previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+            continue
+        digest = file_sha256(full_path)
+        if previous and previous["sha256"] == digest:
+            previous.update(mtime=stat.st_mtime, size=stat.st_size)
+            continue
+        changed[full_path] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest}
+    deleted = [source for source in manifest if source not in seen]
+    return changed, deleted
+
+def parse_pdf(full_path, chunk_size, chunk_overlap):
+    """Process-pool worker: returns the page-level chunks of one PDF"""
+    splitter = make_splitter(chunk_size, chunk_overlap)
+    return full_path, list(iter_chunks(full_path, splitter))
+
+def handle_incremental_processing(input_dir, output_dir, collection_name, config_settings):
+    """Parses only new or changed PDFs and upserts/deletes their chunks by stable id"""
+    started = time.perf_counter()
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    changed, deleted = detect_changes(input_dir, manifest)
+    logging.info(f"{len(changed)} new or changed PDFs, {len(deleted)} deleted")
+
+    db_instance = open_collection(output_dir, collection_name)
+
+    for source in deleted:
+        db_instance.delete(ids=chunk_ids(source, manifest[source]["chunks"]))
+        del manifest[source]
+        logging.info(f"Removed chunks of deleted file {source}")
+
+    total_chunks = 0
+    workers = config_settings.get('INGEST_WORKERS') or os.cpu_count()
+    max_bytes = config_settings.get('INGEST_BATCH_MAX_BYTES')
+    pending_paths = list(changed)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep only a small window of parsed files in flight to bound memory
+        in_flight = set()
+        while pending_paths or in_flight:
+            while pending_paths and len(in_flight) < workers * 2:
+                in_flight.add(pool.submit(parse_pdf, pending_paths.pop(),
+                                          config_settings['CHUNK_SIZE'], config_settings['CHUNK_OVERLAP']))
+            done = next(as_completed(in_flight))
+            in_flight.discard(done)
+            full_path, chunks = done.result()
+            del done
+
+            ids = chunk_ids(full_path, len(chunks))
+            written = 0
+            for batch in iter_batches(chunks, config_settings['BATCH_SIZE'], max_bytes):
+                write_batches(db_instance, batch, len(batch), ids=ids[written:written + len(batch)])
+                written += len(batch)
+
+            remove_trailing_chunks(db_instance, manifest, full_path, len(chunks))
+
+            manifest[full_path] = {**changed[full_path], "chunks": len(chunks)}
+            save_manifest(manifest_path, manifest)
+            total_chunks += len(chunks)
+            logging.info(f"Processed {full_path} ({len(chunks)} chunks)")
+            del chunks
+
+    save_manifest(manifest_path, manifest)
+    if changed or deleted:
+        build_from_collection(db_instance, os.path.join(output_dir, "lexical_index"))
+    elapsed = time.perf_counter() - started
+    report = {
+        "files": len(changed),
+        "deleted": len(deleted),
+        "chunks": total_chunks,
+        "seconds": round(elapsed, 2),
+        "files_per_second": round(len(changed) / elapsed, 2) if elapsed else 0.0,
+        "chunks_per_second": round(total_chunks / elapsed, 2) if elapsed else 0.0,
+        "rss_mb": round(current_rss_mb(), 1),
+    }
+    print(f"Ingestion report: {json.dumps(report)}")
+    return report
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest PDFs into the Chroma collection")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only parse new or changed PDFs, tracked in a manifest")
+    args = parser.parse_args()
+
     load_dotenv()
     config_settings = config.read_config()  # Get the configuration dictionary
     
@@ -57,6 +239,14 @@ if __name__ == "__main__":
     logging.basicConfig(level=config_settings['LOG_LEVEL'])
     logger = logging.getLogger(__name__)
 
+    # Ingestion runs beside the API on the same provider quotas, at low priority;
+    # the share only applies without a shared RATE_LIMIT_DB
+    ratelimit.configure(config_settings, share=config_settings.get('INGEST_RATE_SHARE', 0.5))
+    ratelimit.current_priority.set(ratelimit.BACKGROUND)
+
     pdf_directory = "C:/Users/Wajih/Desktop/Projects Wajih/Graduation/pdf"
     db_directory = os.path.join(config_settings['chroma_base_dir'], config_settings['chroma_collection'])
-    handle_pdf_processing(pdf_directory, db_directory, config_settings['chroma_collection'], config_settings)
\ No newline at end of file
+    if args.incremental:
+        handle_incremental_processing(pdf_directory, db_directory, config_settings['chroma_collection'], config_settings)
+    else:
+        handle_pdf_processing(pdf_directory, db_directory, config_settings['chroma_collection'], config_settings)
\ No newline at end of file
@@ -0,0 +1,131 @@
+# providers.py
+"""Embedding, LLM and web-search back-ends, selected by environment variable.
+
+EMBEDDINGS_PROVIDER: "openai" (default) or "hashing"
+LLM_PROVIDER:        "groq" (default) or "fake"
+SEARCH_PROVIDER:     "serpapi" (default) or "fixture"
+
+The offline back-ends are deterministic and need no network, so the service
+can be benchmarked and regression-tested without OpenAI, Groq or SerpAPI.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from context_builder import WORD_PATTERN
+
+
+class HashingEmbeddings(Embeddings):
+    """Feature-hashed bag of words and bigrams, L2-normalised"""
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = WORD_PATTERN.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = zlib.crc32(feature.encode("utf-8"))
+            vector[digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class FakeChatModel:
+    """Deterministic chat model with configurable latency and a token stream.
+
+    Emits think_tokens of reasoning inside <think> tags, then answer_tokens
+    taken from the prompt, after first_token_latency and at tokens_per_second.
+    """
+
+    def __init__(self, model_name="fake", first_token_latency=0.5, tokens_per_second=200.0,
+                 think_tokens=50, answer_tokens=80):
+        self.model_name = model_name
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.think_tokens = think_tokens
+        self.answer_tokens = answer_tokens
+
+    def _tokens(self, prompt):
+        words = WORD_PATTERN.findall(prompt) or ["answer"]
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        answer = [words[(seed + i) % len(words)] for i in range(self.answer_tokens)]
+        return ["<think>"] + ["reasoning "] * self.think_tokens + ["</think>"] + [f"{w} " for w in answer]
+
+    def invoke(self, prompt):
+        tokens = self._tokens(prompt)
+        time.sleep(self.first_token_latency + len(tokens) / self.tokens_per_second)
+        return AIMessage(content="".join(tokens))
+
+    async def ainvoke(self, prompt):
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.first_token_latency + len(tokens) / self.tokens_per_second)
+        return AIMessage(content="".join(tokens))
+
+    async def astream(self, prompt):
+        await asyncio.sleep(self.first_token_latency)
+        for token in self._tokens(prompt):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield AIMessageChunk(content=token)
+
+
+class FixtureSearch:
+    """SerpAPI stand-in that answers from a JSON fixture of organic results.
+
+    The fixture maps lower-cased queries to result lists under "queries" and
+    has a "default" list; "{site}" in links is replaced with FIXTURE_SITE_URL.
+    """
+
+    def __init__(self, path, site_url=""):
+        with open(path, "r") as f:
+            self.fixture = json.load(f)
+        self.site_url = site_url.rstrip("/")
+
+    def _results(self, query):
+        results = self.fixture.get("queries", {}).get(query.strip().lower(), self.fixture.get("default", []))
+        return [{**r, "link": r["link"].replace("{site}", self.site_url)} for r in results]
+
+    async def aresults(self, query):
+        return {"organic_results": self._results(query)}
+
+
+def get_embedding_client():
+    if os.getenv("EMBEDDINGS_PROVIDER", "openai") == "hashing":
+        return HashingEmbeddings(int(os.getenv("HASHING_DIMENSIONS", 384)))
+    from langchain_community.embeddings import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def get_chat_model(model_name):
+    if os.getenv("LLM_PROVIDER", "groq") == "fake":
+        return FakeChatModel(
+            model_name,
+            first_token_latency=float(os.getenv("FAKE_LLM_LATENCY", 0.5)),
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", 200)),
+            think_tokens=int(os.getenv("FAKE_LLM_THINK_TOKENS", 50)),
+            answer_tokens=int(os.getenv("FAKE_LLM_ANSWER_TOKENS", 80)),
+        )
+    from langchain_groq import ChatGroq
+    return ChatGroq(groq_api_key=os.getenv("GROQ_API_KEY"), model_name=model_name)
+
+
+def get_search_provider():
+    if os.getenv("SEARCH_PROVIDER", "serpapi") == "fixture":
+        return FixtureSearch(os.getenv("SEARCH_FIXTURE", "benchmarks/fixtures/search_results.json"),
+                             os.getenv("FIXTURE_SITE_URL", ""))
+    from langchain_community.utilities import SerpAPIWrapper
+    return SerpAPIWrapper(serpapi_api_key=os.getenv("SERP_API_KEY"))
@@ -0,0 +1,367 @@
+# ratelimit.py
+"""Shared admission control for upstream API calls.
+
+Each provider ("llm", "embeddings", "search") has token buckets for requests
+and tokens per minute. Interactive calls (/ask) reserve capacity ahead of
+anything queued and may wait up to max_wait_seconds; past that, or with
+max_waiting callers already queued, they fail fast with Overloaded so the API
+can answer 503 with Retry-After. Background calls (ingestion) only run on
+capacity left above a headroom kept for interactive traffic. Failed calls are
+retried with full-jitter exponential backoff, honouring Retry-After.
+
+With RATE_LIMIT_DB set the buckets live in that SQLite file, so the API
+workers, the crawler service and ingestion draw on one quota and background
+calls also yield to interactive ones made by other processes.
+"""
+import time
+import random
+import asyncio
+import logging
+import sqlite3
+import threading
+import contextlib
+import contextvars
+
+from context_builder import count_tokens
+import metrics
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Priority of the calls made by the current request or job
+current_priority = contextvars.ContextVar("current_priority", default=INTERACTIVE)
+
+DEFAULT_LIMITS = {
+    "llm": {"requests_per_minute": 30, "tokens_per_minute": 60000},
+    "embeddings": {"requests_per_minute": 3000, "tokens_per_minute": 1000000},
+    "search": {"requests_per_minute": 60},
+}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing when an interactive call would wait too long"""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} is overloaded, retry in {retry_after:.1f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second up to one minute of capacity; may go into debt"""
+
+    def __init__(self, per_minute, now=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + max(now - self.updated, 0.0) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, floor=0.0):
+        """Seconds until the level covers amount and stays above floor"""
+        needed = min(min(amount, self.capacity) + floor, self.capacity)
+        return max(needed - self.level, 0.0) / self.rate
+
+
+class RateLimiter:
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, name, requests_per_minute, tokens_per_minute=None, max_waiting=64,
+                 max_wait_seconds=20.0, background_headroom=0.2):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, self.clock())
+        self.tokens = TokenBucket(tokens_per_minute, self.clock()) if tokens_per_minute else None
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.background_headroom = background_headroom
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.stats = {"admitted": 0, "shed": 0, "retries": 0, "waited_seconds": 0.0}
+
+    def _shed(self, delay):
+        """Raises Overloaded when an interactive call would wait too long or join a full queue"""
+        if delay > self.max_wait_seconds or (delay > 0 and self.waiting >= self.max_waiting):
+            self.stats["shed"] += 1
+            raise Overloaded(self.name, max(delay, 1.0))
+
+    def _amounts(self, tokens):
+        amounts = [(self.requests, 1)]
+        if self.tokens is not None:
+            amounts.append((self.tokens, tokens))
+        return amounts
+
+    @contextlib.contextmanager
+    def _state(self):
+        """Guards reading and updating the buckets"""
+        with self.lock:
+            yield
+
+    def _reserve(self, tokens, priority):
+        """Returns (reserved, delay): wait delay then call if reserved, else wait delay and ask again"""
+        with self._state():
+            now = self.clock()
+            amounts = self._amounts(tokens)
+            for bucket, _ in amounts:
+                bucket.refill(now)
+
+            if priority == BACKGROUND:
+                # Never queue ahead of interactive callers, and leave them some burst
+                delay = max(bucket.delay(amount, bucket.capacity * self.background_headroom)
+                            for bucket, amount in amounts)
+                if self.waiting or delay > 0:
+                    return False, min(max(delay, 0.05), 5.0)
+            else:
+                delay = max(bucket.delay(amount) for bucket, amount in amounts)
+                self._shed(delay)
+                if delay > 0:
+                    self.waiting += 1
+
+            for bucket, amount in amounts:
+                bucket.level -= min(amount, bucket.capacity)
+            self.stats["admitted"] += 1
+            self.stats["waited_seconds"] += delay
+            return True, delay
+
+    def _release(self, tokens, delay, cancelled):
+        if delay > 0:
+            with self.lock:
+                self.waiting -= 1
+        if cancelled:
+            with self._state():
+                # The call never happened, give its capacity back
+                for bucket, amount in self._amounts(tokens):
+                    bucket.level += min(amount, bucket.capacity)
+
+    async def acquire(self, tokens=1, priority=None):
+        priority = current_priority.get() if priority is None else priority
+        while True:
+            reserved, delay = self._reserve(tokens, priority)
+            if reserved:
+                break
+            await asyncio.sleep(delay)
+        if delay > 0:
+            cancelled = True
+            try:
+                with metrics.span(f"ratelimit_{self.name}"):
+                    await asyncio.sleep(delay)
+                cancelled = False
+            finally:
+                self._release(tokens, delay, cancelled)
+
+    def acquire_blocking(self, tokens=1, priority=None):
+        priority = current_priority.get() if priority is None else priority
+        while True:
+            reserved, delay = self._reserve(tokens, priority)
+            if reserved:
+                break
+            time.sleep(delay)
+        if delay > 0:
+            time.sleep(delay)
+            self._release(tokens, delay, False)
+
+    def check(self):
+        """Raises Overloaded when a new interactive call would be shed, without reserving"""
+        with self._state():
+            now = self.clock()
+            amounts = self._amounts(1)
+            for bucket, _ in amounts:
+                bucket.refill(now)
+            self._shed(max(bucket.delay(amount) for bucket, amount in amounts))
+
+
+class SharedRateLimiter(RateLimiter):
+    """RateLimiter whose bucket levels are kept in SQLite and shared by every process using the file.
+
+    Queued interactive calls put the shared buckets into debt, which is what
+    holds back background calls in the other processes.
+    """
+    # Wall clock: monotonic time is not comparable across processes and restarts
+    clock = staticmethod(time.time)
+
+    def __init__(self, name, requests_per_minute, tokens_per_minute=None, path="ratelimit.db", **kwargs):
+        super().__init__(name, requests_per_minute, tokens_per_minute, **kwargs)
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, "
+                        "updated REAL NOT NULL)")
+
+    def _buckets(self):
+        buckets = [(f"{self.name}:requests", self.requests)]
+        if self.tokens is not None:
+            buckets.append((f"{self.name}:tokens", self.tokens))
+        return buckets
+
+    @contextlib.contextmanager
+    def _state(self):
+        """Loads the buckets in a write transaction and stores them back when the caller is done"""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for key, bucket in self._buckets():
+                    row = self.db.execute("SELECT level, updated FROM buckets WHERE name = ?", (key,)).fetchone()
+                    if row is not None:
+                        bucket.level, bucket.updated = min(row[0], bucket.capacity), row[1]
+                yield
+                self.db.executemany("INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                                    [(key, bucket.level, bucket.updated) for key, bucket in self._buckets()])
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+
+_settings = {"limits": DEFAULT_LIMITS, "share": 1.0, "reserved": {}, "db": None, "max_waiting": 64, "max_wait_seconds": 20.0,
+             "retries": 4, "retry_base": 0.5, "retry_max": 20.0}
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def configure(cfg, share=1.0, reserved=None):
+    """Applies RATE_LIMITS and QUEUE_/RETRY_ settings.
+
+    With RATE_LIMIT_DB set every process shares the full limits through that
+    file and share/reserved are ignored. Otherwise share scales the limits for
+    this process, after taking out the reserved fraction of each provider
+    ({provider: fraction}) kept for other processes.
+    """
+    _settings.update({
+        "limits": {**DEFAULT_LIMITS, **cfg.get('RATE_LIMITS', {})},
+        "share": share,
+        "reserved": reserved or {},
+        "db": cfg.get('RATE_LIMIT_DB'),
+        "max_waiting": cfg.get('QUEUE_MAX_WAITING', 64),
+        "max_wait_seconds": cfg.get('QUEUE_MAX_WAIT_SECONDS', 20.0),
+        "retries": cfg.get('RETRY_ATTEMPTS', 4),
+        "retry_base": cfg.get('RETRY_BASE_SECONDS', 0.5),
+        "retry_max": cfg.get('RETRY_MAX_SECONDS', 20.0),
+    })
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def get_limiter(provider) -> RateLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limits = _settings["limits"].get(provider, {"requests_per_minute": 60})
+            tokens_per_minute = limits.get("tokens_per_minute")
+            options = {"max_waiting": _settings["max_waiting"], "max_wait_seconds": _settings["max_wait_seconds"]}
+            if _settings["db"]:
+                limiter = SharedRateLimiter(provider, limits["requests_per_minute"], tokens_per_minute,
+                                            path=_settings["db"], **options)
+            else:
+                share = _settings["share"] * (1 - _settings["reserved"].get(provider, 0.0))
+                limiter = RateLimiter(provider, limits["requests_per_minute"] * share,
+                                      tokens_per_minute * share if tokens_per_minute else None, **options)
+            _limiters[provider] = limiter
+        return limiter
+
+
+def limiter_counters():
+    """Metrics collector for the admission counters of every provider"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    counters = []
+    for limiter in limiters:
+        for key, value in limiter.stats.items():
+            counters.append((f"ratelimit_{key}_total", {"provider": limiter.name}, value))
+    return counters
+
+
+def is_retryable(error) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, ConnectionError) or "rate limit" in str(error).lower() or "429" in str(error)
+
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(error, attempt) -> float:
+    """Full jitter: uniform in [0, min(cap, base * 2**attempt)], unless the provider said when"""
+    ceiling = min(_settings["retry_max"], _settings["retry_base"] * 2 ** attempt)
+    return retry_after(error) or random.uniform(0, ceiling)
+
+
+async def acall(provider, func, *args, tokens=1, **kwargs):
+    """Awaits func(*args, **kwargs) under the provider's limits, retrying transient failures"""
+    limiter = get_limiter(provider)
+    for attempt in range(_settings["retries"] + 1):
+        await limiter.acquire(tokens)
+        try:
+            return await func(*args, **kwargs)
+        except Exception as error:
+            if not is_retryable(error) or attempt == _settings["retries"]:
+                raise
+            wait = backoff_delay(error, attempt)
+            limiter.stats["retries"] += 1
+            logging.warning(f"{provider} call failed ({error}), retrying in {wait:.1f}s")
+            await asyncio.sleep(wait)
+
+
+def call(provider, func, *args, tokens=1, **kwargs):
+    """Blocking counterpart of acall, for embeddings and ingestion threads"""
+    limiter = get_limiter(provider)
+    for attempt in range(_settings["retries"] + 1):
+        limiter.acquire_blocking(tokens)
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            if not is_retryable(error) or attempt == _settings["retries"]:
+                raise
+            wait = backoff_delay(error, attempt)
+            limiter.stats["retries"] += 1
+            logging.warning(f"{provider} call failed ({error}), retrying in {wait:.1f}s")
+            time.sleep(wait)
+
+
+class RateLimitedChatModel:
+    """Chat model wrapper that reserves requests and estimated tokens before each call"""
+
+    def __init__(self, model, provider="llm", completion_tokens=1024):
+        self.model = model
+        self.provider = provider
+        self.completion_tokens = completion_tokens
+
+    def _tokens(self, prompt):
+        return count_tokens(str(prompt)) + self.completion_tokens
+
+    async def ainvoke(self, prompt, **kwargs):
+        return await acall(self.provider, self.model.ainvoke, prompt, tokens=self._tokens(prompt), **kwargs)
+
+    def invoke(self, prompt, **kwargs):
+        return call(self.provider, self.model.invoke, prompt, tokens=self._tokens(prompt), **kwargs)
+
+    async def astream(self, prompt, **kwargs):
+        limiter = get_limiter(self.provider)
+        tokens = self._tokens(prompt)
+        for attempt in range(_settings["retries"] + 1):
+            await limiter.acquire(tokens)
+            started = False
+            try:
+                async for chunk in self.model.astream(prompt, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as error:
+                # Once tokens reached the client a retry would repeat them
+                if started or not is_retryable(error) or attempt == _settings["retries"]:
+                    raise
+                wait = backoff_delay(error, attempt)
+                limiter.stats["retries"] += 1
+                logging.warning(f"{self.provider} stream failed ({error}), retrying in {wait:.1f}s")
+                await asyncio.sleep(wait)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -0,0 +1,78 @@
+# retrieval.py
+import logging
+from langchain_core.documents import Document
+
+
+class FlashRankReranker:
+    """Optional CPU cross-encoder reranker backed by the flashrank package"""
+
+    def __init__(self, model_name="ms-marco-TinyBERT-L-2-v2"):
+        from flashrank import Ranker, RerankRequest
+        self.ranker = Ranker(model_name=model_name)
+        self.request_type = RerankRequest
+
+    def rerank(self, query, docs):
+        passages = [{"id": i, "text": doc.page_content} for i, doc in enumerate(docs)]
+        ranked = self.ranker.rerank(self.request_type(query=query, passages=passages))
+        return [docs[item["id"]] for item in ranked]
+
+
+def load_reranker(name):
+    if not name:
+        return None
+    try:
+        return FlashRankReranker() if name == "flashrank" else FlashRankReranker(name)
+    except ImportError:
+        logging.warning("flashrank is not installed, reranking disabled")
+        return None
+
+
+class HybridRetriever:
+    """Fuses vector and BM25 results with weighted reciprocal rank fusion"""
+
+    def __init__(self, vector_store, lexical_index, k=5, fetch_k=20,
+                 vector_weight=0.5, lexical_weight=0.5, rrf_k=60, reranker=None):
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.k = k
+        self.fetch_k = fetch_k
+        self.vector_weight = vector_weight
+        self.lexical_weight = lexical_weight
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+
+    def _lexical_documents(self, query):
+        hits = self.lexical_index.search(query, self.fetch_k) if self.lexical_index else []
+        if not hits:
+            return []
+        ids = [chunk_id for chunk_id, _ in hits]
+        stored = self.vector_store.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: Document(page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+        }
+        # Chunks deleted since the index was built are skipped
+        return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+    def get_relevant_documents(self, query):
+        ranked_lists = []
+        if self.vector_weight:
+            ranked_lists.append((self.vector_weight, self.vector_store.similarity_search(query, k=self.fetch_k)))
+        if self.lexical_weight:
+            ranked_lists.append((self.lexical_weight, self._lexical_documents(query)))
+
+        scores = {}
+        docs = {}
+        for weight, ranked in ranked_lists:
+            for rank, doc in enumerate(ranked):
+                key = doc.page_content
+                docs.setdefault(key, doc)
+                scores[key] = scores.get(key, 0.0) + weight / (self.rrf_k + rank + 1)
+
+        fused = [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+        if self.reranker is not None:
+            fused = self.reranker.rerank(query, fused)
+        return fused[:self.k]
+
+    def invoke(self, query):
+        return self.get_relevant_documents(query)
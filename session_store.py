@@ -0,0 +1,157 @@
+# session_store.py
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+
+class Session:
+    """Recent turns of one conversation plus a running summary of the older ones"""
+
+    def __init__(self, session_id, email=None):
+        self.session_id = session_id
+        self.email = email
+        self.summary = ""
+        self.messages = []     # recent (role, content), oldest first
+        self.overflow = []     # turns pushed out of messages, waiting to be summarised
+        self.last_seen = time.time()
+        self.compacting = False
+        self.persisted = 0     # messages of this session in the back-end, ours and other workers'
+
+    @property
+    def is_new(self) -> bool:
+        return not (self.summary or self.messages or self.overflow)
+
+
+class SessionStore:
+    """Bounded in-memory sessions with idle expiry and an optional durable back-end.
+
+    Only the last recent_messages messages are kept verbatim; older ones are
+    folded into session.summary by compact(). backend is a ConversationStore,
+    used to persist turns and to restore sessions this process has not seen.
+    With shared=True (several API workers) each access also picks up the turns
+    other workers appended to the back-end since.
+    """
+
+    def __init__(self, idle_seconds=900, max_sessions=10000, recent_messages=6, backend=None, shared=False):
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.recent_messages = recent_messages
+        self.backend = backend
+        self.shared = shared and backend is not None
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"created": 0, "restored": 0, "synced": 0, "expired": 0, "evicted": 0, "compactions": 0}
+
+    def _expire(self, now):
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if now - session.last_seen <= self.idle_seconds:
+                break
+            del self.sessions[session.session_id]
+            self.stats["expired"] += 1
+
+    def _restore(self, session_id, email):
+        """Rebuilds a session from the back-end, None if it has no recent messages"""
+        if self.backend is None:
+            return None
+        rows = self.backend.session_messages(session_id, since=time.time() - self.idle_seconds)
+        if not rows:
+            return None
+        session = Session(session_id, email)
+        self._fold(session, [(role, content) for role, content, _ in rows])
+        session.persisted = self.backend.count_session(session_id)
+        self.stats["restored"] += 1
+        return session
+
+    def _fold(self, session, messages):
+        """Appends messages, moving those beyond the recent window to the overflow"""
+        session.messages.extend(messages)
+        cut = len(session.messages) - self.recent_messages
+        if cut > 0:
+            session.overflow.extend(session.messages[:cut])
+            del session.messages[:cut]
+
+    def _sync(self, session):
+        """Folds in the turns other workers stored since this process last saw the session"""
+        count = self.backend.count_session(session.session_id)
+        if count <= session.persisted:
+            return
+        rows = self.backend.session_messages(session.session_id, offset=session.persisted)
+        with self.lock:
+            self._fold(session, [(role, content) for role, content, _ in rows])
+            session.persisted = count
+        self.stats["synced"] += 1
+
+    def get(self, session_id=None, email=None) -> Session:
+        """Returns the live session for session_id, restoring or creating it as needed"""
+        now = time.time()
+        session_id = session_id or uuid.uuid4().hex
+        with self.lock:
+            self._expire(now)
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                session.last_seen = now
+                session.email = session.email or email
+        if session is not None:
+            if self.shared:
+                self._sync(session)
+            return session
+
+        session = self._restore(session_id, email)
+        with self.lock:
+            if session is None:
+                session = self.sessions.get(session_id) or Session(session_id, email)
+                self.stats["created"] += 1
+            self.sessions[session_id] = session
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.stats["evicted"] += 1
+        return session
+
+    def record(self, session: Session, query: str, answer: str):
+        """Appends a turn, moving turns beyond the recent window to the overflow"""
+        now = time.time()
+        with self.lock:
+            self._fold(session, [("user", query), ("assistant", answer)])
+            session.last_seen = now
+        if self.backend is not None and session.email:
+            self.backend.append_many([
+                (session.email, session.session_id, "user", query, now),
+                (session.email, session.session_id, "assistant", answer, now),
+            ])
+            session.persisted += 2
+            if self.shared:
+                # The next turn may land on another worker
+                self.backend.flush()
+
+    async def compact(self, session: Session, summarize):
+        """Folds the overflow into the summary with summarize(summary, messages) -> str"""
+        with self.lock:
+            if session.compacting or not session.overflow:
+                return
+            session.compacting = True
+            overflow = list(session.overflow)
+        try:
+            summary = await summarize(session.summary, overflow)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            # Keep the latest turns, so the next compaction retries them
+            logging.warning(f"Session summary failed: {error}")
+            with self.lock:
+                del session.overflow[:-self.recent_messages * 2]
+            return
+        finally:
+            session.compacting = False
+        with self.lock:
+            session.summary = summary
+            del session.overflow[:len(overflow)]
+            self.stats["compactions"] += 1
+
+    def __len__(self):
+        return len(self.sessions)
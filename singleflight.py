@@ -0,0 +1,47 @@
+# singleflight.py
+import asyncio
+
+
+class SingleFlight:
+    """Shares one in-flight computation between concurrent callers with the same key.
+
+    At most max_keys computations are tracked; beyond that callers run their own.
+    The shared task is cancelled once every caller waiting on it has been cancelled.
+    """
+
+    def __init__(self, max_keys=1000):
+        self.max_keys = max_keys
+        self.calls = {}  # key -> [task, waiters]
+        self.stats = {"leaders": 0, "coalesced": 0, "bypassed": 0, "cancelled": 0}
+
+    def _forget(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    async def do(self, key, factory):
+        """Returns the result of factory(), awaiting the running call for key if there is one"""
+        call = self.calls.get(key)
+        if call is None:
+            if len(self.calls) >= self.max_keys:
+                self.stats["bypassed"] += 1
+                return await factory()
+            call = [asyncio.ensure_future(factory()), 0]
+            self.calls[key] = call
+            call[0].add_done_callback(lambda _: self._forget(key, call))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["coalesced"] += 1
+
+        call[1] += 1
+        try:
+            # shield: one caller going away must not cancel the others' result
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                call[0].cancel()
+                self._forget(key, call)
+                self.stats["cancelled"] += 1
+
+    def __len__(self):
+        return len(self.calls)
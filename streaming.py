@@ -0,0 +1,52 @@
+# streaming.py
+import json
+
+
+class ThinkFilter:
+    """Incrementally removes <think>...</think> spans from a token stream.
+
+    Only a possible partial tag at the end of the input is held back, so
+    visible text is released as soon as it arrives.
+    """
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.inside = False
+
+    @staticmethod
+    def _partial_tag(text: str, tag: str) -> int:
+        """Length of the longest suffix of text that is a prefix of tag"""
+        for size in range(min(len(text), len(tag) - 1), 0, -1):
+            if text.endswith(tag[:size]):
+                return size
+        return 0
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        visible = []
+        while True:
+            tag = self.CLOSE if self.inside else self.OPEN
+            index = self.buffer.find(tag)
+            if index >= 0:
+                if not self.inside:
+                    visible.append(self.buffer[:index])
+                self.buffer = self.buffer[index + len(tag):]
+                self.inside = not self.inside
+                continue
+
+            keep = self._partial_tag(self.buffer, tag)
+            if not self.inside:
+                visible.append(self.buffer[:len(self.buffer) - keep])
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+            return "".join(visible)
+
+    def flush(self) -> str:
+        remainder = "" if self.inside else self.buffer
+        self.buffer = ""
+        return remainder
+
+
+def ndjson(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
@@ -1,22 +1,19 @@
 # vectordatabase.py
-import os
-import time
-from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from embedding_cache import get_embeddings
 
-def store_documents(db_path, collection, docs, chunk_size, chunk_overlap, batch_limit, delay):
-    """Handles document storage in Chroma vector database"""
+
+def open_collection(db_path, collection):
+    """Opens the Chroma collection with the shared cached embeddings"""
     try:
-        embedding_model = OpenAIEmbeddings(
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
+        embedding_model = get_embeddings()
     except Exception as model_error:
         print(f"Embedding model error: {model_error}")
         raise
 
     try:
-        db_instance = Chroma(
+        return Chroma(
             collection_name=collection,
             embedding_function=embedding_model,
             persist_directory=db_path
@@ -25,20 +22,27 @@ def store_documents(db_path, collection, docs, chunk_size, chunk_overlap, batch_
         print(f"Database initialization error: {db_error}")
         raise
 
+
+def make_splitter(chunk_size, chunk_overlap):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+
+def split_documents(docs, chunk_size, chunk_overlap):
     try:
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
-        )
-        document_chunks = splitter.split_documents(docs)
+        return make_splitter(chunk_size, chunk_overlap).split_documents(docs)
     except Exception as split_error:
         print(f"Document splitting error: {split_error}")
         raise
 
+
+def write_batches(db_instance, document_chunks, batch_limit, ids=None):
+    """Upserts chunks in batches; the embeddings rate limiter paces and retries the calls"""
     for start_idx in range(0, len(document_chunks), batch_limit):
         end_idx = start_idx + batch_limit
         current_batch = document_chunks[start_idx:end_idx]
-        db_instance.add_documents(current_batch)
-        time.sleep(delay)
-        
-    db_instance.persist()
\ No newline at end of file
+        batch_ids = ids[start_idx:end_idx] if ids is not None else None
+        db_instance.add_documents(current_batch, ids=batch_ids)
+
@@ -1,109 +1,306 @@
 # websearch.py
 import os
+import time
 import asyncio
-import aiosqlite
+import hashlib
+import logging
 
 from dotenv import load_dotenv
-from langchain_community.utilities import SerpAPIWrapper
-from crawl4ai import AsyncWebCrawler, CrawlerRunConfig
-from crawl4ai.content_filter_strategy import PruningContentFilter
-from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
-from langchain_groq import ChatGroq
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import OpenAIEmbeddings
-import chromadb
 import re
+from crawl_cache import CrawlCache
+from embedding_cache import get_embeddings
+from context_builder import ContextBuilder, count_tokens
+from providers import get_chat_model, get_search_provider
+from ratelimit import RateLimitedChatModel, Overloaded, acall
+from crawler_service import CrawlerClient
+import metrics
+from metrics import span
+# crawl4ai, chromadb and the langchain vector store are imported on first use,
+# so API workers that delegate crawling to the crawler service never load them
 crawler = None
-from crawl4ai import AsyncWebCrawler
+crawler_client = None
 
-async def init_crawler():
-    global crawler
+async def init_crawler(mode=None, workers=1):
+    """Starts the in-process browser ("local") or connects to the shared crawler service ("service")"""
+    global crawler, crawler_client
+    mode = mode or CRAWLER_MODE
+    if mode == "local" and workers > 1:
+        message = (f"{workers} workers in CRAWLER_MODE=local each start a browser and write ./chroma_db; "
+                   "run crawler_service.py and set CRAWLER_MODE=service")
+        # Only a deliberate choice, e.g. to compare the two modes, is let through
+        if "CRAWLER_MODE" not in os.environ:
+            raise RuntimeError(message)
+        logging.warning(message)
+    if mode == "service":
+        if crawler_client is None:
+            crawler_client = CrawlerClient(CRAWLER_SERVICE_ADDRESS)
+            await crawler_client.connect()
+        return
     if crawler is None:
+        from crawl4ai import AsyncWebCrawler
         crawler = AsyncWebCrawler()
         await crawler.__aenter__()
+    await crawl_cache.open()
+    start_web_index_gc()
 # Load environment variables
 load_dotenv()
-groq_api_key = os.getenv("GROQ_API_KEY")
-openai_api_key = os.getenv("OPENAI_API_KEY")
-serpapi_key = os.getenv("SERP_API_KEY")
-
-# Crawler Configuration
-md_generator = DefaultMarkdownGenerator(
-    content_filter=PruningContentFilter(
-        threshold=0.6,  
-        threshold_type="fixed",
-        min_word_threshold=30 
-    )
-)
 
-config = CrawlerRunConfig(
-    markdown_generator=md_generator,
-    excluded_tags=["form", "header", "footer", "nav", "aside", "script", "style"],
-    remove_overlay_elements=True,
-    process_iframes=True,
+# "local": one browser per process; "service": every worker shares crawler_service.py
+CRAWLER_MODE = os.getenv("CRAWLER_MODE", "local")
+CRAWLER_SERVICE_ADDRESS = os.getenv("CRAWLER_SERVICE_ADDRESS", "127.0.0.1:8765")
+
+# Crawl limits
+MAX_URLS = int(os.getenv("MAX_URLS", 3))
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 3))
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", 15))
+CRAWL_MIN_CHARS = int(os.getenv("CRAWL_MIN_CHARS", 0))  # 0 waits for every URL
+
+# Answers get_info gives when search, crawling or the model failed; callers must not cache them
+NO_WEBSITES_ANSWER = "No relevant websites found."
+NO_CONTENT_ANSWER = "No usable content was found."
+WEB_FAILURE_ANSWER = "Sorry, I couldn't process the query."
+WEB_FALLBACK_ANSWERS = (NO_WEBSITES_ANSWER, NO_CONTENT_ANSWER, WEB_FAILURE_ANSWER)
+
+def crawl_cache_stats():
+    """Counters of this process's crawl cache, None when the crawler service owns it"""
+    return None if crawler_client is not None else crawl_cache.stats
+
+# Search and LLM back-ends, created on first use and shared across queries
+search_provider = None
+web_model = None
+
+
+def get_search():
+    global search_provider
+    if search_provider is None:
+        search_provider = get_search_provider()
+    return search_provider
+
+
+def get_web_model():
+    global web_model
+    if web_model is None:
+        web_model = RateLimitedChatModel(get_chat_model("Qwen-Qwq-32b"))
+    return web_model
+
+# Crawled markdown cache, shared across queries
+crawl_cache = CrawlCache(
+    path=os.getenv("CRAWL_CACHE_PATH", "./crawl_cache.db"),
+    ttl=float(os.getenv("CRAWL_CACHE_TTL", 86400)),
+    max_entries=int(os.getenv("CRAWL_CACHE_MAX_ENTRIES", 2000)),
 )
 
-# Initialize ChromaDB
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
+# Crawler Configuration, built with the crawler
+config = None
+
+
+def get_run_config():
+    global config
+    if config is None:
+        from crawl4ai import CrawlerRunConfig
+        from crawl4ai.content_filter_strategy import PruningContentFilter
+        from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+        md_generator = DefaultMarkdownGenerator(
+            content_filter=PruningContentFilter(
+                threshold=0.6,  
+                threshold_type="fixed",
+                min_word_threshold=30 
+            )
+        )
+
+        config = CrawlerRunConfig(
+            markdown_generator=md_generator,
+            excluded_tags=["form", "header", "footer", "nav", "aside", "script", "style"],
+            remove_overlay_elements=True,
+            process_iframes=True,
+        )
+    return config
+
+# ChromaDB client, opened by the one process that owns ./chroma_db
+chroma_client = None
+
+
+def get_chroma_client():
+    global chroma_client
+    if chroma_client is None:
+        import chromadb
+        chroma_client = chromadb.PersistentClient(path="./chroma_db")
+    return chroma_client
+
+# Persistent web-chunk index, keyed by content hash and reused across queries
+WEB_COLLECTION = "web_content"
+WEB_CHUNK_TTL = float(os.getenv("WEB_CHUNK_TTL", 7 * 86400))
+WEB_GC_INTERVAL = float(os.getenv("WEB_GC_INTERVAL", 3600))
+web_splitter = None
+web_context_builder = ContextBuilder(budget_tokens=int(os.getenv("WEB_CONTEXT_TOKENS", 3000)))
+web_store = None
+web_gc_task = None
+
+
+def split_web_text(text: str) -> list[str]:
+    global web_splitter
+    if web_splitter is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        web_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
+    return web_splitter.split_text(text)
+
+
+def get_web_store():
+    global web_store
+    if web_store is None:
+        from langchain_community.vectorstores import Chroma
+        web_store = Chroma(
+            client=get_chroma_client(),
+            collection_name=WEB_COLLECTION,
+            embedding_function=get_embeddings()
+        )
+    return web_store
+
+
+def chunk_id(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
 
-# Search the Web 
-async def get_web_urls(search_term: str) -> list[str]:
+
+def index_web_chunks(chunks: list[str]) -> list[str]:
+    """Embeds only chunks not already indexed and returns the ids of all of them"""
+    store = get_web_store()
+    collection = get_chroma_client().get_or_create_collection(WEB_COLLECTION, embedding_function=None)
+    by_id = {chunk_id(chunk): chunk for chunk in chunks}
+    ids = list(by_id)
+    now = time.time()
+
+    existing = set(collection.get(ids=ids, include=[])["ids"])
+    new_ids = [i for i in ids if i not in existing]
+    if new_ids:
+        store.add_texts(
+            texts=[by_id[i] for i in new_ids],
+            metadatas=[{"content_hash": i, "last_seen": now} for i in new_ids],
+            ids=new_ids
+        )
+    if existing:
+        # Refresh last_seen so the GC keeps chunks that are still being crawled
+        collection.update(
+            ids=list(existing),
+            metadatas=[{"content_hash": i, "last_seen": now} for i in existing]
+        )
+    print(f"🧩 Web chunks: {len(new_ids)} embedded, {len(existing)} reused")
+    return ids
+
+
+def search_web_chunks(query: str, ids: list[str], k: int = 5):
+    """Searches only the chunks crawled for this query"""
+    return get_web_store().similarity_search(query, k=k, filter={"content_hash": {"$in": ids}})
+
+
+def gc_web_chunks(ttl: float = WEB_CHUNK_TTL) -> None:
+    collection = get_chroma_client().get_or_create_collection(WEB_COLLECTION, embedding_function=None)
+    collection.delete(where={"last_seen": {"$lt": time.time() - ttl}})
+
+
+async def _gc_loop():
+    while True:
+        await asyncio.sleep(WEB_GC_INTERVAL)
+        try:
+            await asyncio.to_thread(gc_web_chunks)
+        except Exception as e:
+            print(f"❌ Web index GC error: {e}")
+
+
+def start_web_index_gc():
+    global web_gc_task
+    if web_gc_task is None:
+        web_gc_task = asyncio.create_task(_gc_loop())
+
+# Search the Web; None when the search failed, [] when it found nothing
+async def get_web_urls(search_term: str):
     try:
-        serp_api = SerpAPIWrapper(serpapi_api_key=serpapi_key)
-        results = await serp_api.aresults(search_term)
+        with span("web_search_api"):
+            results = await acall("search", get_search().aresults, search_term)
         urls = [
             r["link"] for r in results.get("organic_results", [])
             if "link" in r and not r["link"].lower().endswith(".pdf")
         ]
-        return urls[:3]
+        return urls[:MAX_URLS]
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"❌ SERP API error: {e}")
-        return []
+        return None
 
 # Crawl the Web Pages
-async def crawl_urls(urls: list[str]) -> list[str]:
-    content_list = []
-    for url in urls:
-        print(f"🌐 Crawling: {url}")
-        try:
-            result = await crawler.arun(url, config=config)
-            content = result.markdown.strip()
-            if content:
-                content_list.append(f"# Source: {url}\n\n{content}")
-        except Exception as e:
-            print(f"❌ Failed to crawl {url}: {e}")
-    return content_list
+async def crawl_urls(urls: list[str],
+                     max_concurrency: int = CRAWL_CONCURRENCY,
+                     timeout: float = CRAWL_TIMEOUT,
+                     min_chars: int = CRAWL_MIN_CHARS) -> list[str]:
+    semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+    results = [None] * len(urls)
 
-# Generate Answer from Crawled Data
-async def get_model_answer(query: str, content: str) -> str:
-    if not content:
-        return "No usable content was found."
+    async def crawl_one(index: int, url: str) -> int:
+        cached = await crawl_cache.get(url)
+        if cached is not None:
+            print(f"📦 Cache hit: {url}")
+            results[index] = f"# Source: {url}\n\n{cached}"
+            return index
 
-    # Split & embed content
-    splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
-    chunks = splitter.split_text(content)
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-    collection_name = "web_content"
+        async with semaphore:
+            print(f"🌐 Crawling: {url}")
+            try:
+                with span("crawl_page"):
+                    result = await asyncio.wait_for(crawler.arun(url, config=get_run_config()), timeout=timeout)
+                content = result.markdown.strip()
+                if content:
+                    results[index] = f"# Source: {url}\n\n{content}"
+                    await crawl_cache.put(url, content, getattr(result, "response_headers", None))
+            except asyncio.TimeoutError:
+                print(f"⏱️ Timed out crawling {url} after {timeout}s")
+                metrics.inc("crawl_timeouts_total", help_text="Pages that missed the crawl timeout")
+            except Exception as e:
+                print(f"❌ Failed to crawl {url}: {e}")
+        return index
 
+    tasks = [asyncio.create_task(crawl_one(i, url)) for i, url in enumerate(urls)]
+    collected = 0
     try:
-        chroma_client.delete_collection(collection_name)
-    except Exception:
-        pass
-
-    vector_db = Chroma.from_texts(
-        texts=chunks,
-        embedding=embeddings,
-        client=chroma_client,
-        collection_name=collection_name
-    )
-
-    retriever = vector_db.as_retriever(search_kwargs={"k": 5})
-    relevant_docs = retriever.get_relevant_documents(query)
-    context = "\n\n".join(doc.page_content for doc in relevant_docs)
-    print(context)
+        for finished in asyncio.as_completed(tasks):
+            index = await finished
+            if results[index]:
+                collected += len(results[index])
+            if min_chars and collected >= min_chars:
+                break
+    finally:
+        # Stop pages still loading once we have enough content
+        for task in tasks:
+            task.cancel()
+
+    # Keep the SERP ranking order
+    return [content for content in results if content]
+
+# Crawl, index and rank the pages, here or in the shared crawler service
+async def fetch_documents(query: str, urls: list[str], k: int = 5):
+    """Ranked chunks of the crawled pages, None when no page could be crawled"""
+    if crawler_client is not None:
+        with span("crawler_service"):
+            return await crawler_client.documents(query, urls, k)
+
+    with span("crawl"):
+        content_blocks = await crawl_urls(urls)
+    if not content_blocks:
+        return None
+    # Split & embed new content; embedding and Chroma are blocking, so they
+    # run in the loop's bounded executor
+    chunks = split_web_text("\n\n".join(content_blocks))
+    with span("web_embed"):
+        ids = await asyncio.to_thread(index_web_chunks, chunks)
+    with span("web_retrieval"):
+        return await asyncio.to_thread(search_web_chunks, query, ids, k)
+
+# Generate Answer from the ranked web chunks
+async def get_model_answer(query: str, relevant_docs) -> str:
+    if not relevant_docs:
+        return NO_CONTENT_ANSWER
+
+    context, context_stats = web_context_builder.build(relevant_docs)
     # Prompt the model
-    model = ChatGroq(groq_api_key=groq_api_key, model_name="Qwen-Qwq-32b")
     prompt = f"""You are an assistant of Ca'Foscari university of venice for students. Answer the following question using ONLY the provided context.
 
 Question: {query}
@@ -114,25 +311,33 @@ Context:
 If the answer is not found in the context, respond: "I couldn't find this information in the sources."
 
 Provide a concise answer:"""
+    logging.info(f"Web prompt: {count_tokens(prompt)} tokens, context {context_stats}")
 
     try:
-        response = await model.ainvoke(prompt)
+        with span("llm_web"):
+            response = await get_web_model().ainvoke(prompt)
+        metrics.record_tokens("web", count_tokens(prompt), count_tokens(response.content))
         cleaned_content = re.sub(r"<think>.*?</think>", "", response.content, flags=re.DOTALL)
 
         return cleaned_content.strip()
     except Exception as e:
         print(f"❌ Groq model error: {e}")
-        return "Sorry, I couldn't process the query."
+        return WEB_FAILURE_ANSWER
+
+# Ranked web chunks for the single grounded generation
+async def get_web_documents(query: str, k: int = 5):
+    urls = await get_web_urls(query)
+    if not urls:
+        return urls
+    return await fetch_documents(query, urls, k)
 
 # High-Level Async Function
 async def async_query(query: str) -> str:
     urls = await get_web_urls(query)
     if not urls:
-        return "No relevant websites found."
+        return NO_WEBSITES_ANSWER
 
-    content_blocks = await crawl_urls(urls)
-    combined_content = "\n\n".join(content_blocks)
-    return await get_model_answer(query, combined_content)
+    return await get_model_answer(query, await fetch_documents(query, urls))
 
 # Public Function
 async def get_info(query: str) -> str: